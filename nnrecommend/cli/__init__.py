@@ -5,6 +5,7 @@ from nnrecommend.cli.train import train
 from nnrecommend.cli.fit import fit
 from nnrecommend.cli.tune import tune
 from nnrecommend.cli.recommend import recommend
+from nnrecommend.cli.preprocess import preselect_spotify
 
 
 main.add_command(train)
@@ -13,6 +14,7 @@ main.add_command(tune)
 main.add_command(explore_dataset)
 main.add_command(explore_model)
 main.add_command(recommend)
+main.add_command(preselect_spotify)
 
 
 if __name__ == "__main__":
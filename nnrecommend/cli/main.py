@@ -6,6 +6,7 @@ import random
 from typing import Container
 from nnrecommend.logging import setup_log
 from nnrecommend.dataset import BaseDatasetSource
+from nnrecommend.dataset.cache import CachedDatasetSource, DEFAULT_CACHE_DIR
 from nnrecommend.dataset.movielens import MovielensLabDatasetSource, Movielens100kDatasetSource
 from nnrecommend.dataset.podcasts import ItunesPodcastsDatasetSource
 from nnrecommend.dataset.spotify import SpotifyDatasetSource, SpotifyMiniDatasetSource
@@ -16,8 +17,13 @@ DATASET_TYPES = ['movielens-lab', 'movielens', 'podcasts', 'spotify', 'spotify-m
 
 class Context:
 
-    def setup(self, verbose: bool, logoutput: str, hparams: Container[str], hparams_path: str, cpu: bool, empty_cuda: bool=False, random_seed: int=None) -> None:
+    def setup(self, verbose: bool, logoutput: str, hparams: Container[str], hparams_path: str, cpu: bool, empty_cuda: bool=False, random_seed: int=None,
+            dataset_cache: bool=False, dataset_cache_dir: str=DEFAULT_CACHE_DIR, clear_dataset_cache: bool=False) -> None:
         self.logger = setup_log(verbose, logoutput)
+        self.random_seed = random_seed
+        self.dataset_cache = dataset_cache
+        self.dataset_cache_dir = dataset_cache_dir
+        self.clear_dataset_cache = clear_dataset_cache
 
         if not cpu and torch.cuda.is_available():
             self.device = torch.device("cuda")
@@ -39,6 +45,14 @@ class Context:
 
     def create_dataset_source(self, path, dataset_type: str) -> BaseDatasetSource:
         path = os.path.realpath(path)
+        src = self.__create_dataset_source(path, dataset_type)
+        if self.clear_dataset_cache:
+            CachedDatasetSource(src, path, self.dataset_cache_dir, logger=self.logger).clear()
+        if not self.dataset_cache:
+            return src
+        return CachedDatasetSource(src, path, self.dataset_cache_dir, self.random_seed, self.logger)
+
+    def __create_dataset_source(self, path, dataset_type: str) -> BaseDatasetSource:
         if dataset_type == "movielens-lab":
             self.logger.info("creating movielens lab dataset")
             return MovielensLabDatasetSource(path, self.logger)
@@ -69,9 +83,13 @@ class Context:
 @click.option('--cpu', type=bool, is_flag=True, help='force to use cpu device')
 @click.option('--empty-cuda', type=bool, is_flag=True, help='empty cuda cache')
 @click.option('--random-seed', type=int, default=42, help='random seed')
-def main(ctx, verbose: bool, logoutput: str, hparams: Container[str], hparams_path: str, cpu: bool, empty_cuda: bool, random_seed: int):
+@click.option('--dataset-cache', type=bool, is_flag=True, help='cache the loaded datasets')
+@click.option('--dataset-cache-dir', type=click.Path(file_okay=False, dir_okay=True), default=DEFAULT_CACHE_DIR, help='directory to cache the loaded datasets')
+@click.option('--clear-dataset-cache', type=bool, is_flag=True, help='remove the cached datasets before loading')
+def main(ctx, verbose: bool, logoutput: str, hparams: Container[str], hparams_path: str, cpu: bool, empty_cuda: bool, random_seed: int,
+        dataset_cache: bool, dataset_cache_dir: str, clear_dataset_cache: bool):
     """recommender system using deep learning"""
     ctx.ensure_object(Context)
     ctx: Context = ctx.obj
-    ctx.setup(verbose, logoutput, hparams, hparams_path, cpu, empty_cuda, random_seed)
+    ctx.setup(verbose, logoutput, hparams, hparams_path, cpu, empty_cuda, random_seed, dataset_cache, dataset_cache_dir, clear_dataset_cache)
     
@@ -0,0 +1,28 @@
+import sys
+import click
+from nnrecommend.cli.main import main, Context
+from nnrecommend.dataset.spotify import preselect_spotify_logs
+from nnrecommend.logging import get_logger
+
+
+@main.command()
+@click.pass_context
+@click.argument('path', type=click.Path(file_okay=False, dir_okay=True))
+@click.argument('output', type=click.Path(file_okay=False, dir_okay=True))
+@click.option('--sessions', 'amount', type=int, default=10000, help="amount of sessions with most interactions to keep")
+@click.option('--workers', 'max_workers', type=int, help="amount of processes to parse the log files (all the cpus by default)")
+def preselect_spotify(ctx, path: str, output: str, amount: int, max_workers: int) -> None:
+    """
+    extract the sessions with most interactions from the full spotify dataset
+
+    PATH: directory with the log_*.csv files
+
+    OUTPUT: directory where the interactions are saved
+    """
+    ctx: Context = ctx.obj
+    logger = ctx.logger or get_logger(preselect_spotify)
+    preselect_spotify_logs(path, output, amount, max_workers, logger=logger)
+
+
+if __name__ == "__main__":
+    sys.exit(preselect_spotify(obj=Context()))
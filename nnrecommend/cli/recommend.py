@@ -9,7 +9,7 @@ from pandas.core.frame import DataFrame
 from nnrecommend.dataset import load_model
 from nnrecommend.cli.main import Context, main
 from nnrecommend.logging import get_logger
-from nnrecommend.operation import Finder, Recommender
+from nnrecommend.operation import Finder, Recommender, get_user_items
 
 @main.command()
 @click.pass_context
@@ -65,15 +65,10 @@ def recommend(ctx, path: str, labels: Container[str], fields: Container[str], to
             uid = int(labels[0])
             assert uid > 0 and uid < idrange[0]
             ids.append(uid)
-            fitems = []
-            row = matrix[uid]
-            logger.info(f"user {uid} interacted with {len(row)} items...")
+            remove_ids = get_user_items(matrix, uid, idrange).tolist()
+            logger.info(f"user {uid} interacted with {len(remove_ids)} items...")
             logger.info(f"here's {user_items} of them")
-            remove_ids = []
-            for key in row.keys():
-                iid = key[1] - idrange[0]
-                fitems.append(items.loc[iid])
-                remove_ids.append(iid)
+            fitems = [items.loc[iid] for iid in remove_ids]
             if user_items > 0:
                 fitems = random.sample(fitems, user_items)
             for item in fitems:
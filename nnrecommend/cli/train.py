@@ -44,7 +44,7 @@ def train(ctx, path: str, dataset_type: str, model_types: Container[str], output
         items = setup.get_items()
 
         logger.info("creating dataloaders...")
-        trainloader = setup.create_trainloader(hparams)
+        trainloader = setup.create_trainloader(hparams, device)
         testloader = setup.create_testloader(hparams)
         matrix_src = setup.create_adjacency_matrix
 
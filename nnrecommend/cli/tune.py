@@ -47,7 +47,7 @@ def tune(ctx, path: str, dataset_type: str, model_type: str, topk: int, num_samp
             thparams = hparams.copy(config)
             setup = Setup(src, logger)
             idrange = setup(thparams)
-            trainloader = setup.create_trainloader(thparams)
+            trainloader = setup.create_trainloader(thparams, device)
             testloader = setup.create_testloader(thparams)
             matrix_src = setup.create_adjacency_matrix
             model = create_model(model_type, thparams, idrange, matrix_src).to(device)
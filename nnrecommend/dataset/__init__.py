@@ -1,20 +1,628 @@
 import torch
-import random
 import scipy.sparse as sp
 import numpy as np
 import itertools
+import os
+import pandas as pd
 from pandas.core.frame import DataFrame
 from logging import Logger
-from bisect import bisect_left
-from typing import Any, Container, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Container, Dict, Tuple
 from nnrecommend.hparams import HyperParameters
 from nnrecommend.logging import get_logger
 
 
+class ColumnNormalizer:
+    """
+    vectorized engine to normalize the id columns of an interactions array.
+    Every column is converted in one go using numpy sorting and independent
+    columns are run in parallel in a thread pool (numpy releases the GIL).
+    """
+
+    def __init__(self, max_workers: int=None):
+        """
+        :param max_workers: maximum amount of threads (None means the ThreadPoolExecutor default)
+        """
+        self.max_workers = max_workers
+
+    def get_mapping(self, values: np.ndarray, assume_consecutive: bool=False) -> np.ndarray:
+        """
+        :param values: raw ids of a column
+        :param assume_consecutive: assume the ids are consecutive already (only shift)
+        :return: numpy array of raw ids in order
+        """
+        if assume_consecutive:
+            return np.arange(np.min(values), np.max(values)+1)
+        return np.unique(values)
+
+    def normalize(self, values: np.ndarray, colmapping: np.ndarray=None, minv: int=0, assume_consecutive: bool=False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        normalize a column of raw ids
+
+        :param values: raw ids of a column
+        :param colmapping: numpy array of raw ids in order (None to calculate it from the values)
+        :param minv: value added to the normalized ids
+        :param assume_consecutive: assume the ids are consecutive already (only shift)
+        :return: normalized ids, column mapping, boolean mask of the rows with missing ids
+        """
+        values = np.asarray(values)
+        nomissing = np.zeros(len(values), dtype=bool)
+        if colmapping is None:
+            if assume_consecutive:
+                colmapping = self.get_mapping(values, True)
+                ids = values.astype(np.int64) - colmapping[0]
+                return ids + minv, colmapping, nomissing
+            colmapping, ids = np.unique(values, return_inverse=True)
+            return ids.reshape(-1) + minv, colmapping, nomissing
+        colmapping = np.asarray(colmapping)
+        if len(colmapping) == 0:
+            return np.zeros(len(values), dtype=np.int64) + minv, colmapping, ~nomissing
+        # search only the unique values, sorted keys make searchsorted much faster
+        uniques, inverse = np.unique(values, return_inverse=True)
+        ids = np.searchsorted(colmapping, uniques)
+        np.minimum(ids, len(colmapping) - 1, out=ids)
+        missing = colmapping[ids] != uniques
+        inverse = inverse.reshape(-1)
+        return ids[inverse] + minv, colmapping, missing[inverse]
+
+    def normalize_columns(self, columns: Container[np.ndarray], mapping: Container[np.ndarray]=None, assume_consecutive: bool=False) -> Tuple[Container[np.ndarray], Container[np.ndarray], np.ndarray]:
+        """
+        normalize multiple id columns
+
+        :param columns: container with the raw ids of every column
+        :param mapping: a container with each element a numpy array of raw ids in order
+            (None to calculate it for all the columns)
+        :param assume_consecutive: assume the ids are consecutive already (only shift)
+        :return: the normalized ids of every column starting with 0, the mapping,
+            boolean mask of the rows with missing ids
+        """
+        if mapping is None:
+            mapping = [None] * len(columns)
+        assert len(mapping) <= len(columns)
+
+        def normalize(i: int):
+            return self.normalize(columns[i], mapping[i], 0, assume_consecutive)
+
+        if len(mapping) > 1 and self.max_workers != 1:
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                results = list(executor.map(normalize, range(len(mapping))))
+        else:
+            results = [normalize(i) for i in range(len(mapping))]
+
+        ids = []
+        mapping = []
+        missing = np.zeros(len(columns[0]) if len(columns) > 0 else 0, dtype=bool)
+        for colids, colmapping, colmissing in results:
+            ids.append(colids)
+            mapping.append(colmapping)
+            missing |= colmissing
+        return ids, mapping, missing
+
+    def __call__(self, interactions: np.ndarray, mapping: Container[np.ndarray]=None, assume_consecutive: bool=False) -> Tuple[Container[np.ndarray], np.ndarray]:
+        """
+        normalize the id columns of the interactions in place,
+        the ids of every column start where the previous column ends
+
+        :param interactions: 2d array with columns (user id, item id, context, label...)
+        :param mapping: a container with each element a numpy array of raw ids in order
+            (None to calculate it for all the columns except the last one)
+        :param assume_consecutive: assume the ids are consecutive already (only shift)
+        :return: the mapping, boolean mask of the rows with missing ids
+        """
+        ncols = interactions.shape[1] - 1 if mapping is None else len(mapping)
+        columns = [interactions[:, i] for i in range(ncols)]
+        ids, mapping, missing = self.normalize_columns(columns, mapping, assume_consecutive)
+        diff = 0
+        for i, (colids, colmapping) in enumerate(zip(ids, mapping)):
+            interactions[:, i] = colids + diff
+            diff += len(colmapping)
+        return mapping, missing
+
+
+def get_compact_dtype(maxv: int, minv: int=0) -> np.dtype:
+    """
+    get the narrowest integer dtype that can hold the values between minv and maxv
+    """
+    return np.result_type(np.min_scalar_type(minv), np.min_scalar_type(maxv))
+
+
+def compact_array(values: np.ndarray) -> np.ndarray:
+    """
+    convert the array to the narrowest integer dtype that can hold the values,
+    arrays with non integer values are returned as they are
+    """
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return values.astype(np.uint8)
+    if len(values) == 0:
+        return values
+    if np.issubdtype(values.dtype, np.floating):
+        if not np.array_equal(values, np.floor(values)):
+            return values
+    elif not np.issubdtype(values.dtype, np.integer):
+        return values
+    dtype = get_compact_dtype(int(np.max(values)), int(np.min(values)))
+    return values.astype(dtype, copy=False)
+
+
+def hash_ids(values: np.ndarray) -> np.ndarray:
+    """
+    convert raw ids (usually strings) into int64 values with a stable 64 bit hash,
+    unlike the builtin hash the result does not depend on the process (PYTHONHASHSEED)
+
+    :param values: array or series with the raw ids
+    :return: int64 array with the hashed ids
+    """
+    values = np.asarray(values, dtype=object)
+    return pd.util.hash_array(values, categorize=True).view(np.int64)
+
+
+def factorize_values(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    pd.factorize keeping the missing values as another unique value,
+    pandas 1.5 renamed the argument that controls it
+
+    :param values: raw values
+    :return: the codes and the unique values
+    """
+    try:
+        return pd.factorize(values, use_na_sentinel=False)
+    except TypeError:
+        return pd.factorize(values, na_sentinel=None)
+
+
+class IdFactorizer:
+    """
+    assigns consecutive ids to raw values in the order they are found,
+    the mapping grows with every call so columns can be factorized in chunks
+    """
+
+    # key of the missing values, they all get the same id
+    NA_KEY = None
+
+    def __init__(self, dtype: np.dtype=np.int32):
+        """
+        :param dtype: integer dtype of the returned ids
+        """
+        self.dtype = dtype
+        self.__ids = {}
+        self.__uniques = []
+
+    def __len__(self) -> int:
+        return len(self.__ids)
+
+    @property
+    def uniques(self) -> np.ndarray:
+        """
+        the raw values in id order
+        """
+        if len(self.__uniques) == 0:
+            return np.zeros(0, dtype=object)
+        if len(self.__uniques) > 1:
+            self.__uniques = [np.concatenate(self.__uniques)]
+        return self.__uniques[0]
+
+    def __call__(self, values: np.ndarray) -> np.ndarray:
+        """
+        :param values: raw values
+        :return: array with the id of every value
+        """
+        codes, uniques = factorize_values(values)
+        uniques = np.asarray(uniques)
+        keys = uniques.tolist()
+        for i in np.flatnonzero(pd.isna(uniques)):
+            keys[i] = self.NA_KEY
+        n = len(self.__ids)
+        ids = np.fromiter((self.__ids.setdefault(k, len(self.__ids)) for k in keys), dtype=np.int64, count=len(keys))
+        new = ids >= n
+        if new.any():
+            self.__uniques.append(uniques[new])
+        return ids.astype(self.dtype, copy=False)[codes]
+
+
+class TopCounter:
+    """
+    finds the keys with the highest counts in a stream with bounded memory,
+    the counts are estimated with a count-min sketch and only the keys
+    with the highest estimates are kept as candidates.
+    The estimates can only be higher than the real counts,
+    so the candidates should be counted again to get the exact top.
+    """
+
+    HASH_MULTIPLIERS = (0x9E3779B97F4A7C15, 0xBF58476D1CE4E5B9, 0x94D049BB133111EB, 0xD6E8FEB86659FD93,
+        0xA0761D6478BD642F, 0xE7037ED1A0B428DB, 0x8EBC6AF09C88C6E3, 0x589965CC75374CC3)
+
+    def __init__(self, amount: int, width_bits: int=22, depth: int=4):
+        """
+        :param amount: amount of candidate keys to keep
+        :param width_bits: the sketch has 2^width_bits counters per row
+        :param depth: amount of sketch rows (hash functions)
+        """
+        assert depth <= len(self.HASH_MULTIPLIERS)
+        self.amount = amount
+        self.__shift = np.uint64(64 - width_bits)
+        self.__sketch = np.zeros((depth, 1 << width_bits), dtype=np.int64)
+        self.__multipliers = np.array(self.HASH_MULTIPLIERS[:depth], dtype=np.uint64)
+        self.__keys = np.zeros(0, dtype=np.int64)
+        self.total = 0
+
+    def __get_buckets(self, keys: np.ndarray, row: int) -> np.ndarray:
+        keys = keys.view(np.uint64)
+        return ((keys * self.__multipliers[row]) >> self.__shift).astype(np.intp)
+
+    def estimate(self, keys: np.ndarray) -> np.ndarray:
+        """
+        :param keys: int64 array of keys
+        :return: the estimated count of every key
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        counts = np.full(len(keys), np.iinfo(np.int64).max, dtype=np.int64)
+        for row in range(len(self.__sketch)):
+            np.minimum(counts, self.__sketch[row][self.__get_buckets(keys, row)], out=counts)
+        return counts
+
+    def add(self, keys: np.ndarray, counts: np.ndarray=None) -> None:
+        """
+        :param keys: int64 array of keys (can be repeated)
+        :param counts: amount to add for every key (one by default)
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        if counts is None:
+            keys, counts = np.unique(keys, return_counts=True)
+        for row in range(len(self.__sketch)):
+            np.add.at(self.__sketch[row], self.__get_buckets(keys, row), counts)
+        self.total += int(np.sum(counts))
+        keys = np.union1d(self.__keys, keys)
+        if len(keys) > self.amount:
+            estimates = self.estimate(keys)
+            keys = keys[np.argpartition(-estimates, self.amount - 1)[:self.amount]]
+        self.__keys = keys
+
+    def top(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the candidate keys and their estimated counts, sorted from highest
+        """
+        estimates = self.estimate(self.__keys)
+        order = np.argsort(-estimates, kind="stable")
+        return self.__keys[order], estimates[order]
+
+
+class GrowingArray:
+    """
+    one dimensional array buffer that doubles the capacity when full,
+    avoids keeping the list of chunks and the concatenated copy at the same time
+    """
+
+    def __init__(self, dtype: np.dtype, capacity: int=1 << 20):
+        self.__data = np.empty(max(capacity, 1), dtype=dtype)
+        self.__size = 0
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def extend(self, values: np.ndarray) -> None:
+        end = self.__size + len(values)
+        if end > len(self.__data):
+            capacity = max(end, 2 * len(self.__data))
+            data = np.empty(capacity, dtype=self.__data.dtype)
+            data[:self.__size] = self.__data[:self.__size]
+            self.__data = data
+        self.__data[self.__size:end] = values
+        self.__size = end
+
+    def finish(self) -> np.ndarray:
+        """
+        :return: the array with the added values, the buffer should not be used after this
+        """
+        data = self.__data
+        self.__data = None
+        # shrinking reallocates in place instead of copying to a new array
+        data.resize(self.__size, refcheck=False)
+        return data
+
+
+class NegativeSampler:
+    """
+    generates random negative items for many positive interactions at once.
+    The container is converted into a sorted array of (row, column) keys,
+    so checking if an interaction exists is a vectorized binary search
+    and only the rejected candidates need to be drawn again.
+    """
+
+    def __init__(self, container: Container=None, max_tries: int=1000):
+        """
+        :param container: container to check if the interaction exists (usually the adjacency matrix)
+        :param max_tries: maximum amount of times a candidate can be drawn again
+        """
+        self.container = container
+        self.max_tries = max_tries
+        self.draws = 0
+        self.rejections = 0
+        self.__keys = None
+        self.__shape = None
+        if sp.issparse(container):
+            matrix = container.tocoo()
+            self.__shape = matrix.shape
+            keys = matrix.row.astype(np.int64) * matrix.shape[1] + matrix.col
+            keys = np.sort(keys[matrix.data != 0])
+            # sorting and dropping the repeats is faster than np.unique
+            self.__keys = keys[np.insert(keys[1:] != keys[:-1], 0, True)] if len(keys) > 0 else keys
+            del matrix, keys
+
+    @property
+    def rejection_rate(self) -> float:
+        """
+        ratio of the drawn candidates that were rejected
+        """
+        return self.rejections / self.draws if self.draws > 0 else 0.0
+
+    def contains(self, users: np.ndarray, items: np.ndarray) -> np.ndarray:
+        """
+        check if the interactions are in the container
+
+        :param users: array of user ids
+        :param items: array of item ids (same shape as the users)
+        :return: boolean array
+        """
+        users = np.asarray(users)
+        items = np.asarray(items)
+        if self.container is None:
+            return np.zeros(items.shape, dtype=bool)
+        if self.__keys is None:
+            found = [(u, v) in self.container for u, v in zip(users.flat, items.flat)]
+            return np.array(found, dtype=bool).reshape(items.shape)
+        if len(self.__keys) == 0:
+            return np.zeros(items.shape, dtype=bool)
+        nrows, ncols = self.__shape
+        valid = (users >= 0) & (users < nrows) & (items >= 0) & (items < ncols)
+        keys = users.astype(np.int64) * ncols + items
+        pos = np.searchsorted(self.__keys, keys)
+        np.minimum(pos, len(self.__keys) - 1, out=pos)
+        return valid & (self.__keys[pos] == keys)
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        return bool(self.contains(np.array([key[0]]), np.array([key[1]]))[0])
+
+    def get_excluded(self, user: int, item: int, minv: int, maxv: int) -> np.ndarray:
+        """
+        :param user: the user id of the positive interaction
+        :param item: the item id of the positive interaction
+        :param minv: minimum item id
+        :param maxv: maximum item id (not included)
+        :return: sorted array with the item ids of the user that are in the container and the item
+        """
+        if self.container is None:
+            excluded = np.zeros(0, dtype=np.int64)
+        elif self.__keys is None:
+            excluded = np.array([v for v in range(minv, maxv) if (user, v) in self.container], dtype=np.int64)
+        elif user < 0 or user >= self.__shape[0]:
+            excluded = np.zeros(0, dtype=np.int64)
+        else:
+            ncols = self.__shape[1]
+            base = np.int64(user) * ncols
+            start, end = np.searchsorted(self.__keys, (base + max(minv, 0), base + min(maxv, ncols)))
+            excluded = self.__keys[start:end] - base
+        if item >= minv and item < maxv:
+            excluded = np.union1d(excluded, (item,))
+        return excluded
+
+    def sample_unique(self, user: int, item: int, num: int, minv: int, maxv: int, fail_if_less: bool=True) -> np.ndarray:
+        """
+        draw random negative items without repeats for one positive interaction.
+        The unique positions are drawn from the amount of available items and then
+        shifted over the sorted excluded items, so the available items are never materialized.
+
+        :param user: the user id of the positive interaction
+        :param item: the item id of the positive interaction
+        :param num: amount of items to generate (negative or none means all the possible candidates in order)
+        :param minv: minimum item id
+        :param maxv: maximum item id (not included)
+        :param fail_if_less: throw exception if there are less items than requested,
+            if false all the available items are returned
+        """
+        excluded = self.get_excluded(user, item, minv, maxv) - minv
+        available = maxv - minv - len(excluded)
+        if num is None or num < 0:
+            ranks = np.arange(available, dtype=np.int64)
+        elif num > available and fail_if_less:
+            raise ValueError("not enough items to generate random negatives")
+        elif 2 * num >= available:
+            ranks = np.random.permutation(available)[:num]
+        else:
+            # rejection sampling, every draw can add at most one new value
+            ranks = np.unique(np.random.randint(0, available, num, dtype=np.int64))
+            while len(ranks) < num:
+                self.rejections += num - len(ranks)
+                draws = np.random.randint(0, available, num - len(ranks), dtype=np.int64)
+                self.draws += len(draws)
+                ranks = np.union1d(ranks, draws)
+            self.draws += num
+        # the rank of the available items before every excluded item
+        shifted = excluded - np.arange(len(excluded))
+        return ranks + np.searchsorted(shifted, ranks, side="right") + minv
+
+    def count_available(self, users: np.ndarray, items: np.ndarray, minv: int, maxv: int) -> np.ndarray:
+        """
+        amount of possible negative items for many positive interactions
+
+        :param users: array with the user of every positive interaction
+        :param items: array with the item of every positive interaction
+        :param minv: minimum item id
+        :param maxv: maximum item id (not included)
+        :return: array with the amount of items that are not in the container and are not the item
+        """
+        users = np.asarray(users).astype(np.int64)
+        items = np.asarray(items).astype(np.int64)
+        if self.container is not None and self.__keys is None:
+            excluded = [len(self.get_excluded(u, i, minv, maxv)) for u, i in zip(users, items)]
+            return maxv - minv - np.array(excluded, dtype=np.int64)
+        inrange = (items >= minv) & (items < maxv)
+        excluded = inrange.astype(np.int64)
+        if self.container is not None and len(self.__keys) > 0:
+            nrows, ncols = self.__shape
+            valid = (users >= 0) & (users < nrows)
+            base = np.where(valid, users, 0) * ncols
+            starts = np.searchsorted(self.__keys, base + max(minv, 0))
+            ends = np.searchsorted(self.__keys, base + min(maxv, ncols))
+            excluded += np.where(valid, ends - starts, 0)
+            # the item is only counted once if it is in the container
+            excluded -= inrange & self.contains(users, items)
+        return maxv - minv - excluded
+
+    def sample_unique_many(self, users: np.ndarray, items: np.ndarray, num: int, minv: int, maxv: int) -> np.ndarray:
+        """
+        draw random negative items without repeats for many positive interactions at once.
+        The candidates are drawn with the batched sampler and only the repeated ones
+        are drawn again, interactions with few available items use sample_unique.
+
+        :param users: array with the user of every positive interaction
+        :param items: array with the item of every positive interaction
+        :param num: amount of negative items per interaction
+        :param minv: minimum item id
+        :param maxv: maximum item id (not included)
+        :return: array of shape (len(users), num) with the negative items
+        """
+        users = np.asarray(users)
+        items = np.asarray(items)
+        available = self.count_available(users, items, minv, maxv)
+        if (available < num).any():
+            raise ValueError("not enough items to generate random negatives")
+        result = np.empty((len(users), num), dtype=np.int64)
+        dense = 2 * num >= available
+        for row in np.flatnonzero(dense):
+            result[row] = self.sample_unique(users[row], items[row], num, minv, maxv)
+        rows = np.flatnonzero(~dense)
+        if len(rows) == 0 or num == 0:
+            return result
+        sampled = self(users[rows], items[rows], num, minv, maxv)
+        tries = 0
+        while True:
+            # flag every repeated value after the first one in its row
+            order = np.argsort(sampled, axis=1, kind="stable")
+            ordered = np.take_along_axis(sampled, order, axis=1)
+            repeated = np.zeros(sampled.shape, dtype=bool)
+            np.put_along_axis(repeated, order[:, 1:], ordered[:, 1:] == ordered[:, :-1], axis=1)
+            r, c = np.nonzero(repeated)
+            if len(r) == 0:
+                break
+            if tries > self.max_tries:
+                raise ValueError("too many random tries")
+            self.rejections += len(r)
+            sampled[r, c] = self(users[rows[r]], items[rows[r]], 1, minv, maxv)[:, 0]
+            tries += 1
+        result[rows] = sampled
+        return result
+
+    def __call__(self, users: np.ndarray, items: np.ndarray, num: int, minv: int, maxv: int) -> np.ndarray:
+        """
+        draw random negative items for all the positive interactions,
+        repeated negative items for the same interaction are possible
+
+        :param users: array with the user of every positive interaction
+        :param items: array with the item of every positive interaction
+        :param num: amount of negative items per interaction
+        :param minv: minimum item id
+        :param maxv: maximum item id (not included)
+        :return: array of shape (len(users), num) with the negative items
+        """
+        users = np.asarray(users)
+        items = np.asarray(items)
+        result = np.random.randint(minv, maxv, (len(users), num), dtype=np.int64)
+        flat = result.reshape(-1)
+        slots = np.arange(len(flat))
+        tries = 0
+        while len(slots) > 0:
+            if tries > self.max_tries:
+                raise ValueError("too many random tries")
+            rows = slots // num
+            candidates = flat[slots]
+            rejected = candidates == items[rows]
+            rejected |= self.contains(users[rows], candidates)
+            self.draws += len(slots)
+            slots = slots[rejected]
+            self.rejections += len(slots)
+            flat[slots] = np.random.randint(minv, maxv, len(slots), dtype=np.int64)
+            tries += 1
+        return result
+
+
+class ColumnPlan:
+    """
+    records column operations over the interaction columns so that the final
+    columns are built only once. Every column keeps its source array, the rows
+    that are still selected and a pending value shift, so inserting, removing,
+    swapping or shifting columns and filtering rows never copy the columns.
+    """
+
+    def __init__(self, columns: Container[np.ndarray]):
+        self.length = len(columns[0])
+        # every column is a list with (values, selected rows or None, shift)
+        self.columns = [[c, None, 0] for c in columns]
+
+    def __len__(self) -> int:
+        return self.length
+
+    @property
+    def ncols(self) -> int:
+        return len(self.columns)
+
+    def get(self, col: int) -> np.ndarray:
+        values, rows, shift = self.columns[col]
+        if rows is not None:
+            values = values[rows]
+        if shift != 0:
+            values = values.astype(np.int64) + shift
+        return values
+
+    def set(self, col: int, values: np.ndarray) -> None:
+        assert len(values) == self.length
+        self.columns[col] = [values, None, 0]
+
+    def insert(self, col: int, values: np.ndarray) -> None:
+        assert values is None or len(values) == self.length
+        self.columns.insert(col, [values, None, 0])
+
+    def delete(self, col: int) -> None:
+        del self.columns[col]
+
+    def swap(self, col1: int, col2: int) -> None:
+        self.columns[col1], self.columns[col2] = self.columns[col2], self.columns[col1]
+
+    def shift(self, col: int, diff: int) -> None:
+        self.columns[col][2] += diff
+
+    def filter(self, rows: np.ndarray) -> None:
+        """
+        keep only the selected rows
+
+        :param rows: boolean mask or array of row indices
+        """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        composed = {}
+        for column in self.columns:
+            colrows = column[1]
+            key = id(colrows)
+            if key not in composed:
+                composed[key] = rows if colrows is None else colrows[rows]
+            column[1] = composed[key]
+        self.length = len(rows)
+
+
 class InteractionDataset(torch.utils.data.Dataset):
     """
     basic interaction dataset class
+
+    the interactions are stored as one array per column (struct of arrays).
+    Once the ids are normalized, every id column keeps the ids starting with 0
+    using the narrowest integer dtype for its range, and the id range shift
+    is added back when getting rows.
+
+    the column operations can be recorded in a ColumnPlan (see plan)
+    so the columns are built once when the dataset is used.
     """
+
     def __init__(self, interactions: np.ndarray, add_labels_col: bool=False):
         """
         :param interactions: 2d array with columns (user id, item id, context, label...)
@@ -22,16 +630,285 @@ class InteractionDataset(torch.utils.data.Dataset):
         interactions = np.array(interactions)
         assert len(interactions.shape) == 2 # should be two dimensions
         assert interactions.shape[1] > 1 # should have at least 2 columns
-        if add_labels_col or interactions.shape[1] == 2:
+        columns = [np.ascontiguousarray(interactions[:, i]) for i in range(interactions.shape[1])]
+        del interactions
+        if add_labels_col or len(columns) == 2:
             # if the interactions don't come with label column, create it with ones
-            interactions = np.c_[interactions, np.ones(interactions.shape[0], interactions.dtype)]
-        self.__interactions = interactions
-        self.idrange = None
+            columns.append(np.ones(len(columns[0]), dtype=np.uint8))
+        else:
+            columns[-1] = compact_array(columns[-1])
+        self.__columns = columns
+        self.__idrange = None
+        self.__sampler = None
+
+    @classmethod
+    def from_columns(cls, columns: Container[np.ndarray], idrange: np.ndarray=None) -> 'InteractionDataset':
+        """
+        create a dataset from the column arrays without copying them
+
+        :param columns: container with one array per column, the last one is the label
+        :param idrange: the id ranges if the id columns are already normalized
+            (in that case the ids of every column should start with 0)
+        """
+        dataset = cls.__new__(cls)
+        dataset.__columns = list(columns)
+        dataset.__idrange = None if idrange is None else np.array(idrange, dtype=np.int64)
+        dataset.__sampler = None
+        return dataset
+
+    @property
+    def __columns(self) -> Container[np.ndarray]:
+        self.materialize()
+        return self.__data
+
+    @__columns.setter
+    def __columns(self, columns: Container[np.ndarray]) -> None:
+        self.__plan = None
+        self.__data = columns
+
+    @property
+    def lazy(self) -> bool:
+        """
+        if the column operations are being recorded in a plan
+        """
+        return self.__plan is not None
+
+    def plan(self) -> None:
+        """
+        start recording the column operations (inserting, removing, combining,
+        swapping or shifting columns and filtering rows) in a plan instead of
+        modifying the columns every time. The columns are built once when the
+        dataset is indexed or used by any other operation.
+        """
+        if self.__plan is None:
+            self.__plan = ColumnPlan(self.__data)
+
+    def materialize(self) -> None:
+        """
+        apply the pending column plan to the columns
+        """
+        plan = self.__plan
+        if plan is None:
+            return
+        self.__plan = None
+        self.__data = [None] * plan.ncols
+        for i in range(plan.ncols):
+            self.__set_column(i, plan.get(i))
+
+    IDRANGE_FILENAME = "idrange.npy"
+    COLUMN_FILENAME = "column{}.npy"
+
+    def save(self, path: str) -> None:
+        """
+        save the dataset to a directory with one .npy file per column
+
+        :param path: directory where the files will be written
+        """
+        os.makedirs(path, exist_ok=True)
+        for i, column in enumerate(self.__columns):
+            np.save(os.path.join(path, self.COLUMN_FILENAME.format(i)), column)
+        idrange_path = os.path.join(path, self.IDRANGE_FILENAME)
+        if self.__idrange is not None:
+            np.save(idrange_path, self.__idrange)
+        elif os.path.exists(idrange_path):
+            os.remove(idrange_path)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str="r") -> 'InteractionDataset':
+        """
+        load a dataset saved with the save method, by default the columns
+        are memory mapped so the data is only read from disk when accessed
+
+        :param path: directory with the dataset files
+        :param mmap_mode: mode passed to np.load (None to load the data into memory)
+        """
+        columns = []
+        while True:
+            colpath = os.path.join(path, cls.COLUMN_FILENAME.format(len(columns)))
+            if not os.path.exists(colpath):
+                break
+            columns.append(np.load(colpath, mmap_mode=mmap_mode))
+        if len(columns) < 2:
+            raise FileNotFoundError(f"could not find dataset columns in {path}")
+        idrange_path = os.path.join(path, cls.IDRANGE_FILENAME)
+        idrange = np.load(idrange_path) if os.path.exists(idrange_path) else None
+        return cls.from_columns(columns, idrange)
+
+    @property
+    def mapped(self) -> bool:
+        """
+        true if any of the columns is memory mapped from a file
+        """
+        return any(isinstance(c, np.memmap) for c in self.__columns)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # memory mapped columns are pickled as their file so that
+        # DataLoader workers map them again instead of copying the data.
+        # Every operation that changes a column replaces it with an in-memory array
+        columns = []
+        for column in self.__columns:
+            if isinstance(column, np.memmap) and column.filename is not None:
+                column = (column.filename, column.dtype, column.shape, column.offset)
+            columns.append(column)
+        return {"columns": columns, "idrange": self.__idrange}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        columns = []
+        for column in state["columns"]:
+            if isinstance(column, tuple):
+                filename, dtype, shape, offset = column
+                column = np.memmap(filename, dtype=dtype, mode="r", shape=shape, offset=offset)
+            columns.append(column)
+        self.__columns = columns
+        self.__idrange = state["idrange"]
+        self.__sampler = None
+
+    @property
+    def idrange(self) -> np.ndarray:
+        """
+        array with the end of the id range of every column (None if not normalized)
+        """
+        return self.__idrange
+
+    @idrange.setter
+    def idrange(self, idrange: np.ndarray) -> None:
+        if idrange is not None:
+            idrange = np.array(idrange, dtype=np.int64)
+            if self.__idrange is None:
+                # the current ids are already normalized, store them starting with 0
+                self.__idrange = idrange
+                for i in range(len(idrange)):
+                    self.__set_column(i, self.__columns[i].astype(np.int64) - self.__get_offset(i))
+                return
+        elif self.__idrange is not None:
+            self.__columns = [self.__get_column(i) for i in range(self.__ncols)]
+        self.__idrange = idrange
+
+    @property
+    def columns(self) -> Container[np.ndarray]:
+        """
+        the stored column arrays, id columns start with 0 if normalized
+        """
+        return tuple(self.__columns)
+
+    @property
+    def dtype(self) -> np.dtype:
+        """
+        dtype of the rows returned when indexing the dataset
+        """
+        if self.__idrange is None:
+            return np.result_type(*self.__columns)
+        nids = len(self.__idrange)
+        dtypes = [c.dtype for c in self.__columns[nids:]]
+        if nids > 0:
+            maxv = self.__idrange[-1]
+            dtypes.append(np.int32 if maxv <= np.iinfo(np.int32).max else np.int64)
+        return np.result_type(*dtypes)
+
+    @property
+    def __ncols(self) -> int:
+        if self.__plan is not None:
+            return self.__plan.ncols
+        return len(self.__data)
+
+    def __get_stored(self, col: int) -> np.ndarray:
+        """
+        get the stored values of a column without materializing the plan
+        """
+        if self.__plan is not None:
+            return self.__plan.get(col)
+        return self.__data[col]
+
+    def __store(self, col: int, values: np.ndarray) -> None:
+        if self.__plan is not None:
+            self.__plan.set(col, values)
+        else:
+            self.__data[col] = values
+
+    def __insert_stored(self, col: int) -> None:
+        if self.__plan is not None:
+            self.__plan.insert(col, None)
+        else:
+            self.__data.insert(col, None)
+
+    def __delete_stored(self, col: int) -> None:
+        if self.__plan is not None:
+            self.__plan.delete(col)
+        else:
+            del self.__data[col]
+
+    def __swap_stored(self, col1: int, col2: int) -> None:
+        if self.__plan is not None:
+            self.__plan.swap(col1, col2)
+        else:
+            self.__data[col1], self.__data[col2] = self.__data[col2], self.__data[col1]
+
+    def __shift_stored(self, col: int, diff: int) -> None:
+        if self.__plan is not None:
+            self.__plan.shift(col, diff)
+        else:
+            self.__set_column(col, self.__data[col].astype(np.int64) + diff)
+
+    def __get_offset(self, col: int) -> int:
+        if self.__idrange is None or col <= 0 or col >= len(self.__idrange):
+            return 0
+        return int(self.__idrange[col-1])
+
+    def __get_column(self, col: int, rows=None) -> np.ndarray:
+        """
+        get the values of a column, id columns are converted to int64 and shifted
+        """
+        values = self.__get_stored(col)
+        if rows is not None:
+            values = values[rows]
+        if self.__idrange is None or col >= len(self.__idrange):
+            return values
+        values = values.astype(np.int64)
+        offset = self.__get_offset(col)
+        if offset != 0:
+            values += offset
+        return values
+
+    def __set_column(self, col: int, values: np.ndarray) -> None:
+        """
+        set the values of a column, id columns should start with 0
+        """
+        values = np.asarray(values)
+        if self.__idrange is not None and col < len(self.__idrange):
+            start = self.__get_offset(col)
+            dtype = get_compact_dtype(max(int(self.__idrange[col]) - start - 1, 0))
+            if len(values) > 0 and (values.min() < 0 or values.max() >= self.__idrange[col] - start):
+                values = compact_array(values)
+            else:
+                values = values.astype(dtype, copy=False)
+        elif col == self.__ncols - 1:
+            values = compact_array(values)
+        self.__store(col, values)
+
+    def __filter_rows(self, cond: np.ndarray) -> None:
+        if self.__plan is not None:
+            self.__plan.filter(cond)
+        else:
+            self.__data = [c[cond] for c in self.__data]
+
+    def __get_rows(self, index) -> np.ndarray:
+        columns = self.__columns
+        first = columns[0][index]
+        shape = np.shape(first) + (len(columns), )
+        rows = np.empty(shape, dtype=self.dtype)
+        rows[..., 0] = first
+        del first
+        for i in range(1, len(columns)):
+            rows[..., i] = columns[i][index]
+            offset = self.__get_offset(i)
+            if offset != 0:
+                rows[..., i] += offset
+        return rows
 
     def __validate_mapping(self, mapping: Container[np.ndarray]) -> Container[np.ndarray]:
         mapping = [np.array(v) for v in mapping]
         assert isinstance(mapping, (list, tuple))
-        assert len(mapping) < self.__interactions.shape[1]
+        assert len(mapping) < self.__ncols
         return mapping
 
     def denormalize_ids(self, mapping: Container[np.ndarray]) -> Container[np.ndarray]:
@@ -41,25 +918,55 @@ class InteractionDataset(torch.utils.data.Dataset):
         :param mapping: a container with each element a numpy array of raw ids in order
         """
         mapping = self.__validate_mapping(mapping)
-        i = 0
-        diff = 0
-        missing = set()
-        for colmapping in mapping:
-            colgen = IdFinder(colmapping)
-            for j, row in enumerate(self.__interactions):
-                v = colgen.reverse(row[i] - diff)
-                if v is None:
-                    missing.add(j)
-                else:
-                    row[i] = v
-            diff += len(colmapping)
-            i += 1
-        self.__interactions = np.delete(self.__interactions, list(missing), 0)
-        self.idrange = None
+        self.__require_normalized()
+        missing = np.zeros(len(self), dtype=bool)
+        columns = []
+        for i, colmapping in enumerate(mapping):
+            ids = self.__columns[i].astype(np.int64)
+            colmissing = ids >= len(colmapping)
+            if colmissing.any():
+                missing |= colmissing
+                ids[colmissing] = 0
+            columns.append(colmapping[ids] if len(colmapping) > 0 else ids)
+        columns += [self.__get_column(i) for i in range(len(columns), self.__ncols)]
+        self.__columns = columns
+        self.__idrange = None
+        if missing.any():
+            self.__filter_rows(~missing)
         return mapping
 
+    def compact_ids(self, mapping: Container[np.ndarray]=None) -> Container[np.ndarray]:
+        """
+        renumber the normalized ids so that they are consecutive again after removing rows,
+        this is equivalent to denormalizing and normalizing again but the raw ids are never touched.
+
+        :param mapping: a container with each element a numpy array of raw ids in order
+        :return: the mapping composed with the old to new remap
+            (if no mapping is passed, the old normalized ids that were kept)
+        """
+        self.__require_normalized()
+        if mapping is not None:
+            mapping = self.__validate_mapping(mapping)
+        ids = []
+        newmapping = []
+        for i in range(len(self.__idrange)):
+            minv, maxv = self.__get_col_range(i)
+            colids = self.__columns[i]
+            used = np.zeros(maxv - minv, dtype=bool)
+            used[colids] = True
+            kept = np.flatnonzero(used)
+            if len(kept) < len(used):
+                remap = np.cumsum(used) - 1
+                colids = remap[colids]
+            ids.append(colids)
+            newmapping.append(kept if mapping is None else mapping[i][kept])
+        self.__idrange = np.cumsum([len(m) for m in newmapping], dtype=np.int64)
+        for i, colids in enumerate(ids):
+            self.__set_column(i, colids)
+        return newmapping
+
     def __require_normalized(self) -> None:
-        if self.idrange is None:
+        if self.__idrange is None:
             self.normalize_ids()
 
     def normalize_ids(self, assume_consecutive=False) -> Container[np.ndarray]:
@@ -70,18 +977,7 @@ class InteractionDataset(torch.utils.data.Dataset):
         :param assume_consecutive: assume the ids are consecutive already (only shift)
         :return mapping: a container with each element a numpy array of raw ids in order
         """
-        mapping = []
-        for i in range(self.__interactions.shape[1] - 1):
-            ids = self.__interactions[:, i]
-            colmapping = self.__get_col_mapping(ids, assume_consecutive)
-            mapping.append(colmapping)
-        self.__normalize_ids(mapping)
-        return mapping
-
-    def __get_col_mapping(self, values: np.ndarray, assume_consecutive=False) -> np.ndarray:
-        if assume_consecutive:
-            return np.arange(np.min(values), np.max(values)+1)
-        return np.sort(np.unique(values))
+        return self.__normalize_ids(None, assume_consecutive)
 
     def map_ids(self, mapping: Container[np.ndarray]) -> Container[np.ndarray]:
         """
@@ -89,63 +985,77 @@ class InteractionDataset(torch.utils.data.Dataset):
 
         :param mapping: a container with each element a numpy array of raw ids in order
         """
-        assert self.idrange is None
+        assert self.__idrange is None
         mapping = self.__validate_mapping(mapping)
-        self.__normalize_ids(mapping)
+        return self.__normalize_ids(mapping)
+
+    def __normalize_ids(self, mapping: Container[np.ndarray]=None, assume_consecutive=False) -> Container[np.ndarray]:
+        if self.__idrange is not None:
+            self.idrange = None
+        normalizer = ColumnNormalizer()
+        ids, mapping, missing = normalizer.normalize_columns(self.__columns[:-1], mapping, assume_consecutive)
+        self.__idrange = np.cumsum([len(colmapping) for colmapping in mapping], dtype=np.int64)
+        for i, colids in enumerate(ids):
+            self.__set_column(i, colids)
+        del ids
+        if missing.any():
+            self.__filter_rows(~missing)
         return mapping
 
-    def __normalize_ids(self, mapping: Container[np.ndarray]) -> None:
-        diff = 0
-        self.idrange = np.zeros(len(mapping), dtype=np.int64)
-        missing = set()
-        for i, colmapping in enumerate(mapping):
-            ids = self.__interactions[:, i]
-            ids, colmissing = self.__normalize_col(ids, colmapping, diff)
-            self.__interactions[:, i] = ids
-            missing.update(colmissing)
-            diff += len(colmapping)
-            self.idrange[i] = diff
-        self.__interactions = np.delete(self.__interactions, list(missing), 0)
-
-    def __normalize_col(self, values: np.ndarray, colmapping: np.ndarray, minv: int) -> Tuple[np.ndarray, np.ndarray]:
-        """
-        :returns: normalized items, rows with missing items
-        """
-        missing = []
-        colgen = IdFinder(colmapping)
-        for i, v in enumerate(values):
-            v = colgen.find(v)
-            if v is None:
-                missing.append(i)
-            else:
-                values[i] = v + minv
-        return values, missing
-
     def get_grounded(self) -> np.ndarray:
         """
         :returns: the interactions with id columns starting with zero
         """
         self.__require_normalized()
-        interactions = self.__interactions.copy()
-        for i, maxv in enumerate(self.idrange[:-1]):
-            interactions[:, i+1] -= maxv
-        return interactions
+        dtype = np.result_type(*self.__columns)
+        return np.column_stack(self.__columns).astype(dtype, copy=False)
 
     def __len__(self) -> int:
-        return len(self.__interactions)
+        if self.__plan is not None:
+            return len(self.__plan)
+        return len(self.__data[0])
 
     def __getitem__(self, index) -> np.ndarray:
-        return self.__interactions[index]
+        if not isinstance(index, tuple):
+            return self.__get_rows(index)
+        rows = index[0]
+        if len(index) == 2 and isinstance(index[1], (int, np.integer)):
+            # only one column
+            col = index[1] % self.__ncols
+            return self.__get_column(col, rows).astype(self.dtype, copy=False)
+        values = self.__get_rows(rows)
+        if values.ndim == 1:
+            return values[index[1:]]
+        return values[(slice(None), ) + index[1:]]
 
     def __setitem__(self, index, val: np.ndarray) -> None:
-        self.__interactions[index] = val
+        if isinstance(index, tuple) and len(index) == 2 and isinstance(index[1], (int, np.integer)):
+            # only one column
+            col = index[1] % self.__ncols
+            values = self.__get_column(col).copy()
+            values[index[0]] = val
+            self.__set_column(col, values - self.__get_offset(col))
+            return
+        values = self.__get_rows(slice(None))
+        values[index] = val
+        for col in range(self.__ncols):
+            self.__set_column(col, values[:, col] - self.__get_offset(col))
 
-    def __get_row_pairs(self, row: np.ndarray) -> Container[np.ndarray]:
-        max = -1 if self.idrange is None else len(self.idrange)
-        return itertools.combinations(row[:max], 2)
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        values = self.__get_rows(slice(None))
+        return values if dtype is None else values.astype(dtype, copy=False)
 
     MAX_RANDOM_TRIES = 1000
 
+    def __get_sampler(self, container: Container=None) -> 'NegativeSampler':
+        if isinstance(container, NegativeSampler):
+            return container
+        sampler = self.__sampler
+        if sampler is None or sampler.container is not container:
+            sampler = NegativeSampler(container, self.MAX_RANDOM_TRIES)
+            self.__sampler = sampler
+        return sampler
+
     def get_random_negative_item(self, user: int, item: int, container: Container = None) -> int:
         """
         generate a random negative item, will keep trying to generate an item that is not in
@@ -154,21 +1064,7 @@ class InteractionDataset(torch.utils.data.Dataset):
         :param user: the item of the positive interaction
         :param container: pass a container to check that the interaction is not in it
         """
-        assert self.idrange is not None
-        c = 0
-        v = None
-        minv, maxv = self.idrange[0:2]
-        while True:
-            if c > self.MAX_RANDOM_TRIES:
-                raise ValueError("too many random tries")
-            v = np.random.randint(minv, maxv, dtype=np.int64)
-            c += 1
-            if v == item:
-                continue
-            if container is not None and (user, v) in container:
-                continue
-            break
-        return v
+        return self.get_random_negative_items(user, item, 1, container)[0]
 
     def get_random_negative_items(self, user: int, item: int, num: int=1, container: Container=None) -> np.ndarray:
         """
@@ -180,10 +1076,10 @@ class InteractionDataset(torch.utils.data.Dataset):
         :param num: amount of items to generate
         :param container: container to check if the interaction exists (usually the adjacency matrix)
         """
-        items = []
-        for i in range(num):
-            items.append(self.get_random_negative_item(user, item, container))
-        return np.array(items)
+        assert self.__idrange is not None
+        minv, maxv = self.__idrange[0:2]
+        sampler = self.__get_sampler(container)
+        return sampler(np.array([user]), np.array([item]), num, minv, maxv)[0]
 
     def get_unique_random_negative_items(self, user: int, item: int, num: int=None, container: Container=None, fail_if_less: bool=False) -> np.ndarray:
         """
@@ -196,15 +1092,10 @@ class InteractionDataset(torch.utils.data.Dataset):
         :param container: container to check if the interaction exists (usually the adjacency matrix)
         :param fail_if_less: throw exception if there is less items that requested
         """
-        assert self.idrange is not None
-        items = [i for i in range(self.idrange[0], self.idrange[1]) if i != item]
-        if container is not None:
-            items = [i for i in items if (user, i) not in container]
-        if isinstance(num, int) and num >= 0:
-            if fail_if_less and len(items) < num:
-                raise ValueError("not enough items to generate random negatives")
-            items = random.sample(items, num)
-        return np.array(items)
+        assert self.__idrange is not None
+        minv, maxv = self.__idrange[0:2]
+        sampler = self.__get_sampler(container)
+        return sampler.sample_unique(user, item, num, minv, maxv, fail_if_less)
 
     def get_random_negative_rows(self, row: np.ndarray, num: int=None, container: Container=None, unique: bool=False) -> np.ndarray:
         """
@@ -233,56 +1124,78 @@ class InteractionDataset(torch.utils.data.Dataset):
         """
         add negative samples to the dataset interactions
         with random item ids that don't match existing interactions
-        the negative samples will be placed at the end of the interactions array
-        we're trying to optimize memory consumption peaks by resizing the interactions array
+        the negative samples will be placed at the end of the interactions
+        that are allocated only once to optimize memory consumption peaks
 
         real negative samples will be added to sampling groups of the same user
 
+        the grown columns are always in-memory arrays, so a dataset loaded with
+        memory mapped columns (see load) stops being out-of-core after this,
+        use the dynamic_negatives hyperparameter to sample per batch instead.
+
         :param num: amount of negative samples per interaction (None or negative means add all possible)
-        :param container: container to check if the interaction exists (usually the adjacency matrix)
+        :param container: container to check if the interaction exists (usually the adjacency matrix),
+            pass a NegativeSampler to reuse it and get the rejection counters
         :param unique: if the items for each user should not be repeated (slower)
         :return: container of arrays with row indices for every group
         """
         self.__require_normalized()
-        indices = []
-        p = len(self.__interactions)
-        c = self.__interactions.shape[1]
-        neg_byuser = {}
-        indices_byuser = {}
-
-        def add_byuser(container: Dict[int, Container[int]], u: int, v: int) -> Container[int]:
-            if u in container:
-                group = container[u]
+        container = self.__get_sampler(container)
+        p = len(self)
+        labels = self.__columns[-1]
+        positives = np.flatnonzero(labels > 0)
+        users = self.__get_column(0, positives)
+        items = self.__get_column(1, positives)
+        minv, maxv = self.__idrange[0:2]
+        # all the possible candidates have a different amount for every interaction
+        complete = not isinstance(num, int) or num < 0
+        if complete:
+            nitems = [container.sample_unique(u, i, -1, minv, maxv) for u, i in zip(users, items)]
+            counts = np.array([len(v) for v in nitems], dtype=np.int64)
+            nitems = np.concatenate(nitems) if len(nitems) > 0 else np.zeros(0, dtype=np.int64)
+        else:
+            sample = container.sample_unique_many if unique else container
+            nitems = sample(users, items, num, minv, maxv).reshape(-1)
+            counts = np.full(len(positives), num, dtype=np.int64)
+        del users, items
+
+        n = p + len(nitems)
+        rows = np.repeat(positives, counts)
+        nitems -= self.__get_offset(1)
+        for i, column in enumerate(self.__columns):
+            values = np.empty(n, dtype=column.dtype)
+            values[:p] = column
+            if i == 1:
+                values[p:] = nitems
+            elif i == self.__ncols - 1:
+                values[p:] = 0
             else:
-                group = []
-                container[u] = group
-            group.append(v)
-            return group
-
-        for i in range(p):
-            row = self.__interactions[i]
-            u = row[0]
-            if not self.__is_row_positive(row):
-                add_byuser(neg_byuser, u, i)
-                continue
-            nrows = self.get_random_negative_rows(row, num, container, unique)
-            del row
-            n = p + len(nrows)
-            self.__interactions.resize((n, c), refcheck=False)
-            self.__interactions[p:] = nrows
-            del nrows
-            add_byuser(indices_byuser, u, len(indices))
-            gidx = np.arange(p, n, dtype=np.int64)
-            gidx = np.insert(gidx, 0, i)
-            indices.append(gidx)
-            p = n
+                np.take(column, rows, out=values[p:])
+            self.__columns[i] = values
+            del column, values
+        del nitems, rows
+
+        if complete:
+            ends = p + np.cumsum(counts)
+            indices = [np.insert(np.arange(e - l, e, dtype=np.int64), 0, i) for i, e, l in zip(positives, ends, counts)]
+        else:
+            groups = np.arange(p, n, dtype=np.int64).reshape(len(positives), num)
+            indices = list(np.column_stack((positives, groups)))
+            del groups
+
         # adding real negative interactions to the end of the groups of the same user
-        for u, rows in neg_byuser.items():
-            if u not in indices_byuser:
-                continue
-            group = indices_byuser[u]
-            for i in rows:
-                j = group[i % len(group)]
+        negatives = np.flatnonzero(labels <= 0)
+        if len(negatives) > 0 and len(positives) > 0:
+            pusers = self.__columns[0][positives]
+            order = np.argsort(pusers, kind="stable")
+            pusers = pusers[order]
+            nusers = self.__columns[0][negatives]
+            starts = np.searchsorted(pusers, nusers, side="left")
+            ngroups = np.searchsorted(pusers, nusers, side="right") - starts
+            for i, start, ngroup in zip(negatives, starts, ngroups):
+                if ngroup == 0:
+                    continue
+                j = order[start + i % ngroup]
                 indices[j] = np.append(indices[j], i)
 
         return indices
@@ -293,17 +1206,52 @@ class InteractionDataset(torch.utils.data.Dataset):
         """
         return row[-1] > 0
 
+    def __extract(self, cond: np.ndarray) -> 'InteractionDataset':
+        """
+        move the rows to a new dataset
+        """
+        dataset = InteractionDataset.from_columns([c[cond] for c in self.__columns], self.__idrange)
+        if cond.dtype == bool:
+            self.__filter_rows(~cond)
+        else:
+            keep = np.ones(len(self), dtype=bool)
+            keep[cond] = False
+            self.__filter_rows(keep)
+        return dataset
+
     def extract_negative_dataset(self) -> 'InteractionDataset':
         """
         extract a new dataset with the negative values
         """
-        cond = self.__interactions[:, -1] == 0
-        negset = InteractionDataset(self.__interactions[cond])
-        old = self.__interactions
-        self.__interactions = self.__interactions[~cond]
-        del old
-        negset.idrange = self.idrange.copy()
-        return negset
+        self.__require_normalized()
+        return self.__extract(self.__columns[-1] == 0)
+
+    def get_test_indices(self, num_user_interactions: int=1, min_keep_user_interactions: int=1, take_bottom:bool=True) -> np.ndarray:
+        """
+        find the positive interactions of every user for the test dataset,
+        check that the user has a minimum amount of interactions before extracting
+
+        :param num_user_interactions: amount of user interactions to extract to the test dataset
+        :param min_keep_user_interactions: minimum amount of user interactions to keep in the original dataset
+        :param take_bottom: set to true to take the last interactions
+        :return: sorted array with the row indices of the test interactions
+        """
+        self.__require_normalized()
+        positives = np.flatnonzero(self.__columns[-1] > 0)
+        users = self.__columns[0][positives].astype(np.int64)
+        # stable sort keeps the interactions of every user in the original order
+        order = np.argsort(users, kind="stable")
+        users = users[order]
+        counts = np.bincount(users)
+        starts = np.cumsum(counts) - counts
+        ranks = np.arange(len(users)) - starts[users]
+        totals = counts[users]
+        if take_bottom:
+            cond = ranks >= totals - num_user_interactions
+        else:
+            cond = ranks < num_user_interactions
+        cond &= totals >= num_user_interactions + min_keep_user_interactions
+        return np.sort(positives[order[cond]])
 
     def extract_test_dataset(self, num_user_interactions: int=1, min_keep_user_interactions: int=1, take_bottom:bool=True) -> 'InteractionDataset':
         """
@@ -315,80 +1263,91 @@ class InteractionDataset(torch.utils.data.Dataset):
         :param take_bottom: set to true to take the last interactions
         :return: test Dataset
         """
-        self.__require_normalized()
-        rowsbyuser = {}
-        for i, row in enumerate(self.__interactions):
-            if not self.__is_row_positive(row):
-                continue
-            u = row[0]
-            if u not in rowsbyuser:
-                userrows = []
-                rowsbyuser[u] = userrows
-            else:
-                userrows = rowsbyuser[u]
-            userrows.append(i)
-        rows = []
-        for userrows in rowsbyuser.values():
-            if len(userrows) < num_user_interactions + min_keep_user_interactions:
-                continue
-            if take_bottom:
-                rows += userrows[-num_user_interactions:]
-            else:
-                rows += userrows[:num_user_interactions]
-            del userrows
+        rows = self.get_test_indices(num_user_interactions, min_keep_user_interactions, take_bottom)
+        return self.__extract(rows)
+
+    ADJACENCY_CHUNK_SIZE = 1 << 22
 
-        testset = InteractionDataset(self.__interactions[rows])
-        self.__interactions = np.delete(self.__interactions, rows, axis=0)
-        testset.idrange = self.idrange.copy()
-        return testset
+    def __create_sparse(self, size: Tuple[int, int], get_coords: Callable[[slice], Tuple[np.ndarray, np.ndarray]],
+            format: str, weighted: bool, chunk_size: int) -> sp.spmatrix:
+        """
+        assemble a sparse matrix from the coordinates of every interaction,
+        processing the interactions in chunks to limit the memory usage
+        """
+        chunk_size = chunk_size or self.ADJACENCY_CHUNK_SIZE
+        matrix = sp.csr_matrix(size, dtype=np.int64)
+        for start in range(0, len(self), chunk_size):
+            rows, cols = get_coords(slice(start, start+chunk_size))
+            data = np.ones(len(rows), dtype=np.int64)
+            # converting to csr sums the duplicates
+            matrix += sp.coo_matrix((data, (rows, cols)), shape=size).tocsr()
+            del rows, cols, data
+            if not weighted:
+                matrix.data[:] = 1
+        return matrix.asformat(format)
 
-    def create_adjacency_submatrix(self, col1: int = 0, col2: int = 1, half = False) -> sp.spmatrix:
+    def create_adjacency_submatrix(self, col1: int = 0, col2: int = 1, half = False,
+            format: str = "csr", weighted: bool = False, chunk_size: int = None) -> sp.spmatrix:
         """
         create the adjacency submatrix for the dataset
+
+        :param col1: column of the rows
+        :param col2: column of the columns
+        :param half: only return the col1-col2 block instead of a symmetric matrix
+        :param format: scipy sparse matrix format
+        :param weighted: set to true to have the amount of interactions instead of ones
+        :param chunk_size: amount of interactions processed at once
         """
         self.__require_normalized()
         min1, max1 = self.__get_col_range(col1)
         min2, max2 = self.__get_col_range(col2)
         diff1 = max1 - min1
         diff2 = max2 - min2
+        col1 = self.__normalize_col_num(col1)
+        col2 = self.__normalize_col_num(col2)
+
+        def get_coords(rows: slice) -> Tuple[np.ndarray, np.ndarray]:
+            a = self.__columns[col1][rows].astype(np.int64)
+            b = self.__columns[col2][rows].astype(np.int64)
+            if half:
+                return a, b
+            b += diff1
+            return np.concatenate((a, b)), np.concatenate((b, a))
+
         if half:
             size = (diff1, diff2)
         else:
             size = (diff1 + diff2, diff1 + diff2)
-        matrix = sp.dok_matrix(size, dtype=np.int64)
-        for row in self.__interactions:
-            a = row[col1] - min1
-            b = row[col2] - min2
-            if half:
-                matrix[a, b] = 1
-            else:
-                b += diff1
-                matrix[a, b] = 1
-                matrix[b, a] = 1
-        return matrix
+        return self.__create_sparse(size, get_coords, format, weighted, chunk_size)
 
-    def create_adjacency_matrix(self) -> sp.spmatrix:
+    def create_adjacency_matrix(self, format: str = "csr", weighted: bool = False, chunk_size: int = None) -> sp.spmatrix:
         """
         create the adjacency matrix for the dataset
+
+        :param format: scipy sparse matrix format
+        :param weighted: set to true to have the amount of interactions instead of ones
+        :param chunk_size: amount of interactions processed at once
         """
         self.__require_normalized()
-        size = self.idrange[-1]
-        matrix = sp.dok_matrix((size, size), dtype=np.int64)
-        for row in self.__interactions:
-            for a, b in self.__get_row_pairs(row):
-                matrix[a, b] = 1
-                matrix[b, a] = 1
-        return matrix
+        size = self.__idrange[-1]
+        pairs = list(itertools.combinations(range(len(self.__idrange)), 2))
+
+        def get_coords(rows: slice) -> Tuple[np.ndarray, np.ndarray]:
+            a = np.concatenate([self.__get_column(i, rows) for i, _ in pairs])
+            b = np.concatenate([self.__get_column(j, rows) for _, j in pairs])
+            return np.concatenate((a, b)), np.concatenate((b, a))
+
+        return self.__create_sparse((size, size), get_coords, format, weighted, chunk_size)
 
     def __normalize_col_num(self, col: int):
-        return col % self.__interactions.shape[1]
+        return col % self.__ncols
 
     def __get_col_range(self, col: int) -> Tuple[int]:
         self.__require_normalized()
         col = self.__normalize_col_num(col)
-        assert col >= 0 and col < len(self.idrange)
-        start = self.idrange[col-1] if col > 0 else 0
-        end = self.idrange[col]
+        assert col >= 0 and col < len(self.__idrange)
+        start = self.__idrange[col-1] if col > 0 else 0
+        end = self.__idrange[col]
         return start, end
 
     def __get_submatrix(self, matrix: sp.spmatrix, col1: int, col2: int) -> sp.spmatrix:
@@ -401,11 +1360,11 @@ class InteractionDataset(torch.utils.data.Dataset):
         remove random rows until the dataset has size
         """
         assert size >= 0
-        v = len(self.__interactions)
+        v = len(self)
         if size > v:
             return
         rows = np.random.choice(np.arange(0, v), size)
-        self.__interactions = self.__interactions[rows]
+        self.__filter_rows(rows)
 
     def remove_low(self, matrix: sp.spmatrix, lim: int, col1: int, col2: int) -> int:
         """
@@ -421,10 +1380,9 @@ class InteractionDataset(torch.utils.data.Dataset):
         self.__require_normalized()
         submatrix = self.__get_submatrix(matrix, col1, col2)
         counts = np.asarray(submatrix.sum(1)).flatten()
-        minv = 0 if col1 == 0 else self.idrange[col1 - 1]
-        ids = self.__interactions[:, col1] - minv
+        ids = self.__columns[self.__normalize_col_num(col1)]
         cond = counts[ids] > lim
-        self.__interactions =  self.__interactions[cond]
+        self.__filter_rows(cond)
         return np.count_nonzero(cond == False)
 
     def remove_low_users(self, matrix: sp.spmatrix, lim: int) -> int:
@@ -450,10 +1408,9 @@ class InteractionDataset(torch.utils.data.Dataset):
             return 0
         counts = np.asarray(submatrix.sum(1)).flatten()
         topids = counts.argsort()[-amount:]
-        minv = 0 if col1 == 0 else self.idrange[col1 - 1]
-        ids = self.__interactions[:, col1] - minv
+        ids = self.__columns[self.__normalize_col_num(col1)]
         cond = np.isin(ids, topids)
-        self.__interactions =  self.__interactions[cond]
+        self.__filter_rows(cond)
         return np.count_nonzero(cond == False)
 
     def keep_top_users(self, matrix: sp.spmatrix, amount: int) -> int:
@@ -468,10 +1425,49 @@ class InteractionDataset(torch.utils.data.Dataset):
         """
         return self.keep_top(matrix, amount, 1, 0)
 
+    def remove_low_core(self, min_user_interactions: int, min_item_interactions: int, max_iterations: int=None) -> Container[int]:
+        """
+        remove the rows of users and items with low amount of distinct interactions
+        repeating until no more rows are removed (k-core), since removing items can
+        leave users under the limit and the other way around
+
+        :param min_user_interactions: remove rows of users with this or less distinct items
+        :param min_item_interactions: remove rows of items with this or less distinct users
+        :param max_iterations: stop after this amount of iterations (None to reach the fixed point)
+        :returns: amount of removed rows in every iteration
+        """
+        self.__require_normalized()
+        users = self.__columns[0]
+        items = self.__columns[1]
+        nusers, nitems = self.__idrange[0], self.__idrange[1] - self.__idrange[0]
+        # flag the first row of every user item pair to count distinct interactions,
+        # the rows of a pair are always removed together so the flags stay valid
+        key = users.astype(np.int64) * nitems + items
+        first = np.zeros(len(self), dtype=bool)
+        first[np.unique(key, return_index=True)[1]] = True
+        del key
+        rows = np.arange(len(self))
+        removed = []
+        while max_iterations is None or len(removed) < max_iterations:
+            u, i, f = users[rows], items[rows], first[rows]
+            cond = np.ones(len(rows), dtype=bool)
+            if min_user_interactions > 0:
+                cond &= np.bincount(u[f], minlength=nusers)[u] > min_user_interactions
+            if min_item_interactions > 0:
+                cond &= np.bincount(i[f], minlength=nitems)[i] > min_item_interactions
+            c = len(rows) - np.count_nonzero(cond)
+            if c == 0:
+                break
+            removed.append(c)
+            rows = rows[cond]
+        if len(rows) < len(self):
+            self.__filter_rows(rows)
+        return removed
+
     def remove_low_all(self, matrix: sp.spmatrix, lim: int) -> int:
         self.__require_normalized()
         count = 0
-        cols = len(self.idrange)
+        cols = len(self.__idrange)
         for (col1, col2) in itertools.combinations(range(0, cols), 2):
             count += self.remove_low(matrix, lim, col1, col2)
         return count
@@ -482,11 +1478,45 @@ class InteractionDataset(torch.utils.data.Dataset):
         :param insert_col: the column where to insert
         """
         colmapping = np.arange(0, amount)
-        h = self.__interactions.shape[0]
+        h = len(self)
         values = np.random.randint(0, amount, (h, ), dtype=np.int64)
         self.insert_column(insert_col, values, colmapping)
-    
-    def add_previous_item_column(self, items_col: int=1, insert_col: int=-1) -> None:
+
+    def __get_user_order(self, items_col: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        stable sort of the interactions by user
+
+        :return: the order, the sorted users and the sorted items
+        """
+        users = self.__get_stored(0)
+        order = np.argsort(users, kind="stable")
+        users = users[order]
+        items = self.__get_stored(self.__normalize_col_num(items_col))[order].astype(np.int64)
+        return order, users, items
+
+    def __get_previous_items(self, order: np.ndarray, users: np.ndarray, items: np.ndarray, offset: int) -> np.ndarray:
+        values = np.full(len(order), -1, dtype=np.int64)
+        if offset < len(order):
+            same = users[offset:] == users[:-offset]
+            values[order[offset:]] = np.where(same, items[:-offset], -1)
+        return values
+
+    def get_previous_items(self, items_col: int=1, offset: int=1) -> np.ndarray:
+        """
+        find the item of a previous interaction by the same user for every interaction,
+        the item column is shifted inside the runs of every user after a stable sort
+
+        the interaction rows need to be already sorted from older to newer.
+
+        :param items_col: the column index where the items are
+        :param offset: how many interactions before the current one
+        :return: array with the item ids starting with 0 and -1 if there is no previous item
+        """
+        assert offset > 0
+        self.__require_normalized()
+        return self.__get_previous_items(*self.__get_user_order(items_col), offset)
+
+    def add_previous_item_column(self, items_col: int=1, insert_col: int=-1, offset: int=1) -> None:
         """
         adds a new context column with the values of the previous item
         by the same user. The values are consecutive to the last column
@@ -496,26 +1526,32 @@ class InteractionDataset(torch.utils.data.Dataset):
 
         :param items_col: the column index where the items are
         :param insert_col: the column index where to insert
+        :param offset: how many interactions before the current one
         """
-        self.__require_normalized()
-
         minv, maxv = self.__get_col_range(items_col)
+        values = self.get_previous_items(items_col, offset)
+        colmapping = np.arange(-1, maxv - minv)
+        self.insert_column(insert_col, values, colmapping)
 
-        values = np.zeros(self.__interactions.shape[0])
-        for i in range(self.idrange[0]):
-            # find all the interactions of a user
-            cond = self.__interactions[:, 0] == i
-            # get the items
-            items = self.__interactions[cond, items_col]
-            # shift them so they start with 0
-            items -= minv
-            # add a -1 in the beginning and remove the last one
-            items = np.insert(items, 0, -1)[:-1]
-            # add user items to the values
-            values[cond] = items
+    def add_previous_items_columns(self, amount: int, items_col: int=1, insert_col: int=-1) -> None:
+        """
+        adds a window of context columns with the last items by the same user,
+        the first inserted column has the previous item, the second one the item before that...
+        the interactions are sorted by user only once for all the columns
 
+        :param amount: size of the window
+        :param items_col: the column index where the items are
+        :param insert_col: the column index where to insert the first column
+        """
+        self.__require_normalized()
+        insert_col = self.__normalize_col_num(insert_col)
+        minv, maxv = self.__get_col_range(items_col)
         colmapping = np.arange(-1, maxv - minv)
-        self.insert_column(insert_col, values, colmapping)
+        order, users, items = self.__get_user_order(items_col)
+        values = [self.__get_previous_items(order, users, items, i + 1) for i in range(amount)]
+        del order, users, items
+        for i, colvalues in enumerate(values):
+            self.insert_column(insert_col + i, colvalues, colmapping)
 
     def insert_column(self, col: int, values: np.ndarray, colmapping: np.ndarray=None) -> np.ndarray:
         """
@@ -524,23 +1560,22 @@ class InteractionDataset(torch.utils.data.Dataset):
         """
         self.__require_normalized()
         col = self.__normalize_col_num(col)
-        minv = 0 if col == 0 else self.idrange[col-1]
-        if colmapping is None:
-            colmapping = self.__get_col_mapping(values)
-        values, missing = self.__normalize_col(values, colmapping, minv)
-        self.__interactions = np.delete(self.__interactions, list(missing), 0)
+        minv = 0 if col == 0 else self.__idrange[col-1]
+        values, colmapping, missing = ColumnNormalizer().normalize(values, colmapping)
+        if missing.any():
+            self.__filter_rows(~missing)
+            values = values[~missing]
         diff = len(colmapping)
-        for i in range(col+1, len(self.idrange)):
-            self.__interactions[:, i] += diff
-            self.idrange[i] += diff
-        self.__interactions = np.insert(self.__interactions, col, values, axis=1)
-        self.idrange = np.insert(self.idrange, col, minv + diff)
+        self.__idrange[col:] += diff
+        self.__idrange = np.insert(self.__idrange, col, minv + diff)
+        self.__insert_stored(col)
+        self.__set_column(col, values)
         return colmapping
 
     def combine_columns(self, base_col: int, *other_cols: Container[int]) -> None:
         """
         combines multiple columns into one, updating idanges too
-        combining means that the values will be multiplied so 
+        combining means that the values will be multiplied so
         we end up with a normalized column
 
         :param base_col: column number that will be replaced with the combination
@@ -548,19 +1583,21 @@ class InteractionDataset(torch.utils.data.Dataset):
         """
         self.__require_normalized()
         base_col = self.__normalize_col_num(base_col)
-        minb, maxb = self.__get_col_range(base_col)
-        brange = maxb - minb
+        ranges = list(np.diff(self.__idrange, prepend=0))
+        brange = ranges[base_col]
+        base = self.__get_stored(base_col).astype(np.int64)
 
         for col in sorted(other_cols, reverse=True):
             col = self.__normalize_col_num(col)
-            minv, maxv = self.__get_col_range(col)
-            vals = self.__interactions[:, col] - minv
-            range = maxv - minv
-            self.__interactions[:, base_col] += vals*brange
-            brange *= range
-            self.__interactions = np.delete(self.__interactions, col, 1)
-            self.idrange = np.delete(self.idrange, col)
-        self.idrange[base_col] = minb + brange
+            base += self.__get_stored(col).astype(np.int64) * brange
+            brange *= ranges[col]
+            self.__delete_stored(col)
+            del ranges[col]
+            if col < base_col:
+                base_col -= 1
+        ranges[base_col] = brange
+        self.__idrange = np.cumsum(ranges, dtype=np.int64)
+        self.__set_column(base_col, base)
 
     def remove_column(self, col: int) -> None:
         """
@@ -570,11 +1607,9 @@ class InteractionDataset(torch.utils.data.Dataset):
         col = self.__normalize_col_num(col)
         minv, maxv = self.__get_col_range(col)
         diff = maxv - minv
-        for i in range(col + 1, len(self.idrange)):
-            self.idrange[i] -= diff
-            self.__interactions[:, i] -= diff
-        self.__interactions = np.delete(self.__interactions, col, 1)
-        self.idrange = np.delete(self.idrange, col)
+        self.__idrange[col+1:] -= diff
+        self.__delete_stored(col)
+        self.__idrange = np.delete(self.__idrange, col)
 
     def unify_column(self, col: int) -> None:
         """
@@ -584,46 +1619,50 @@ class InteractionDataset(torch.utils.data.Dataset):
         col = self.__normalize_col_num(col)
         minv, maxv = self.__get_col_range(col)
         diff = maxv - minv - 1
-        for i in range(col + 1, len(self.idrange)):
-            self.idrange[i] -= diff
-            self.__interactions[:, i] -= diff
-        self.__interactions[:, col] = minv
-        self.idrange[col] = minv + 1
-
-    def get_counts(self):
-        """
-        return an array of interactions size with the amount of same user, item interactions for every pair
-        """
-        counts = {}
-        col = np.zeros(self.__interactions.shape[0])
-        for i, row in enumerate(self.__interactions):
-            key = row[0:2]
-            k = tuple(key)
-            if k in counts:
-                v = counts[k]
-            else:
-                v = np.count_nonzero((self.__interactions[:, 0:2] == key).all(axis=1))
-                counts[k] = v
-            col[i] = v
-        return col
+        self.__idrange[col+1:] -= diff
+        self.__idrange[col] = minv + 1
+        self.__set_column(col, np.zeros(len(self), dtype=np.uint8))
+
+    def __get_columns_key(self, cols: Container[int]) -> np.ndarray:
+        """
+        encode the values of multiple columns into one int64 key per interaction
+        """
+        key = np.zeros(len(self), dtype=np.int64)
+        size = 1
+        for col in cols:
+            uniques, codes = np.unique(self.__columns[col], return_inverse=True)
+            if size * len(uniques) >= np.iinfo(np.int64).max:
+                # compress the key so that it does not overflow
+                uniques, key = np.unique(key, return_inverse=True)
+                key = key.reshape(-1).astype(np.int64)
+                size = len(uniques)
+            key = key * len(uniques) + codes.reshape(-1)
+            size *= len(uniques)
+        return key
+
+    def get_counts(self, cols: Container[int]=(0, 1)) -> np.ndarray:
+        """
+        return an array of interactions size with the amount of interactions
+        with the same values in the given columns for every interaction
+
+        :param cols: column numbers to compare (by default the user, item pair)
+        """
+        key = self.__get_columns_key(cols)
+        _, inverse, counts = np.unique(key, return_inverse=True, return_counts=True)
+        return counts[inverse.reshape(-1)]
 
     def __swap_columns(self, col1: int, col2: int) -> None:
         assert col1 < col2
-        min1, max1 = self.__get_col_range(col1)
-        min2, max2 = self.__get_col_range(col2)
-        values1 = self.__interactions[:, col1]
-        values2 = self.__interactions[:, col2].copy()
-        colmapping1 = np.arange(min1, max1)
-        colmapping2 = np.arange(min2, max2)
-        self.remove_column(col1)
-        self.insert_column(col1, values2, colmapping2)
-        self.insert_column(col2, values1, colmapping1)
-        self.remove_column(col2 + 1)
+        ranges = np.diff(self.__idrange, prepend=0)
+        ranges[[col1, col2]] = ranges[[col2, col1]]
+        self.__idrange = np.cumsum(ranges)
+        self.__swap_stored(col1, col2)
 
     def swap_columns(self, col1: int, col2: int) -> None:
         """
         swap two dataset columns maintaining the ranges
         """
+        self.__require_normalized()
         col1 = self.__normalize_col_num(col1)
         col2 = self.__normalize_col_num(col2)
         if col1 == col2:
@@ -633,14 +1672,12 @@ class InteractionDataset(torch.utils.data.Dataset):
         return self.__swap_columns(col1, col2)
 
     def __shift_column_values(self, col: int) -> int:
-        minv = 0 if col == 0 else self.idrange[col - 1]
-        cond = self.__interactions[:, col] != minv
-        c = len(self.__interactions)
-        self.__interactions =  self.__interactions[cond]
-        c -= len(self.__interactions)
-        for i in range(col, len(self.idrange)):
-            self.idrange[i] -= 1
-            self.__interactions[:, i] -= 1
+        cond = self.__get_stored(col) != 0
+        c = len(self)
+        self.__filter_rows(cond)
+        c -= len(self)
+        self.__idrange[col:] -= 1
+        self.__shift_stored(col, -1)
         return c
 
     def prepare_for_recommend(self, prev_item_col: int=None) -> int:
@@ -654,7 +1691,7 @@ class InteractionDataset(torch.utils.data.Dataset):
             self.add_previous_item_column()
             prev_item_col = -2
         prev_item_col = self.__normalize_col_num(prev_item_col)
-        assert prev_item_col > 1 and prev_item_col < len(self.idrange)
+        assert prev_item_col > 1 and prev_item_col < len(self.__idrange)
         self.remove_column(0) # remove users
         # swap items and previous items
         item_col = 0
@@ -668,50 +1705,236 @@ class InteractionPairDataset(torch.utils.data.Dataset):
     """
     returns pairs of positive and negative interactions
     used in the trainset when pairwise loss is enabled
+    the pairs are stored as two arrays of row indices, so a batch of indices
+    can be gathered with one index per array
     """
 
     def __init__(self, dataset: Container[np.ndarray], groups: Container[np.ndarray]):
+        """
+        :param dataset: the dataset with the rows
+        :param groups: container of arrays with row indices, the first one is the positive and the rest negatives
+        """
         self.dataset = dataset
-        self.indices = []
-        for group in groups:
-            if len(group) < 2:
-                continue
-            p = group[0]
-            for n in group[1:]:
-                self.indices.append((p, n))
+        if isinstance(groups, np.ndarray) and groups.ndim == 2:
+            lens = np.full(len(groups), groups.shape[1], dtype=np.int64)
+            indices = groups.reshape(-1)
+        else:
+            lens = np.fromiter((len(g) for g in groups), dtype=np.int64, count=len(groups))
+            indices = np.concatenate(groups) if len(groups) > 0 else np.zeros(0, dtype=np.int64)
+        starts = np.cumsum(lens) - lens
+        starts, lens = starts[lens > 0], lens[lens > 0]
+        dtype = np.int32 if len(dataset) <= np.iinfo(np.int32).max else np.int64
+        self.positives = np.repeat(indices[starts], lens - 1).astype(dtype, copy=False)
+        negatives = np.ones(len(indices), dtype=bool)
+        negatives[starts] = False
+        self.negatives = indices[negatives].astype(dtype, copy=False)
 
     def __len__(self) -> int:
-        return len(self.indices)
+        return len(self.positives)
 
     def __getitem__(self, index) -> Tuple:
-        p, n = self.indices[index]
-        pos, neg = self.dataset[p], self.dataset[n]
-        assert pos[0] == neg[0]
-        return pos, neg
+        return self.dataset[self.positives[index]], self.dataset[self.negatives[index]]
+
+
+class NegativeSamplingDataset(torch.utils.data.Dataset):
+    """
+    draws new negative samples every time the positive interactions are read,
+    so the trainset only stores the positives and every epoch sees different negatives.
+    Indexing with an array of rows samples the negatives of the whole batch at once.
+    Rows that are not positive interactions are not used.
+    """
+
+    def __init__(self, dataset: 'InteractionDataset', sampler: NegativeSampler, num: int, pairwise: bool=False):
+        """
+        :param dataset: normalized dataset with the positive interactions
+        :param sampler: sampler used to check the existing interactions (usually with the user-item matrix)
+        :param num: amount of negative samples per positive interaction
+        :param pairwise: return (positive, negative) pairs instead of positive and negative rows together
+        """
+        assert num > 0
+        self.dataset = dataset
+        self.sampler = sampler
+        self.num = num
+        self.pairwise = pairwise
+        self.positives = np.flatnonzero(dataset.columns[-1] > 0)
+        self.minv, self.maxv = (int(v) for v in dataset.idrange[0:2])
+
+    @property
+    def samples_per_row(self) -> int:
+        """
+        amount of rows (or pairs) returned for every positive interaction
+        """
+        return self.num if self.pairwise else self.num + 1
+
+    def __len__(self) -> int:
+        return len(self.positives)
+
+    def __getitem__(self, index):
+        rows = self.dataset[np.atleast_1d(self.positives[index])]
+        items = self.sampler(rows[:, 0], rows[:, 1], self.num, self.minv, self.maxv)
+        negrows = np.repeat(rows, self.num, axis=0)
+        negrows[:, 1] = items.reshape(-1)
+        negrows[:, -1] = 0
+        if self.pairwise:
+            return np.repeat(rows, self.num, axis=0), negrows
+        return np.concatenate((rows, negrows))
+
+
+def seed_worker(worker_id: int) -> None:
+    """
+    used in a DataLoader.worker_init_fn so every worker draws different numpy random numbers
+    """
+    np.random.seed(torch.initial_seed() % 2**32)
 
 
 class GroupingDataset(torch.utils.data.Dataset):
     """
     groups the data by values in one column
     used for the testset to get batches separated by user
+
+    indexing with an array of groups returns an array of shape (groups, candidates, fields),
+    ragged groups are padded repeating their first row with the label set to -1
     """
 
+    PADDING_LABEL = -1
+
     def __init__(self, dataset: Container[np.ndarray], groups: Container[np.ndarray]):
         self.dataset = dataset
         self.groups = groups
+        lens = np.fromiter((len(g) for g in groups), dtype=np.int64, count=len(groups))
+        self.candidates = int(lens.max()) if len(lens) > 0 else 0
+        self.padding = np.arange(self.candidates) >= lens[:, np.newaxis]
+        self.indices = np.zeros(self.padding.shape, dtype=np.int64)
+        if len(groups) > 0:
+            self.indices[~self.padding] = np.concatenate(groups)
+            starts = self.indices[:, :1]
+            self.indices = np.where(self.padding, starts, self.indices)
+        if not self.padding.any():
+            self.padding = None
 
     def __len__(self) -> int:
         return len(self.groups)
 
-    def __getitem__(self, index) -> Tuple:
-        return self.dataset[self.groups[index]]
+    def __getitem__(self, index) -> np.ndarray:
+        if np.ndim(index) == 0:
+            return self.dataset[self.groups[index]]
+        rows = self.dataset[self.indices[index]]
+        if self.padding is not None:
+            rows[self.padding[index], -1] = self.PADDING_LABEL
+        return rows
+
+
+def get_chunk_permutation(size: int, chunk_size: int) -> np.ndarray:
+    """
+    permutation that shuffles the order of contiguous chunks and the positions inside every chunk
+
+    :param size: amount of positions
+    :param chunk_size: amount of consecutive positions in a chunk
+    :return: array with the shuffled positions
+    """
+    assert chunk_size > 0
+    chunks = np.random.permutation((size + chunk_size - 1) // chunk_size)
+    order = np.empty_like(chunks)
+    order[chunks] = np.arange(len(chunks))
+    positions = np.arange(size)
+    return np.lexsort((np.random.random(size), order[positions // chunk_size]))
+
+
+class BatchShuffleSampler(torch.utils.data.Sampler):
+    """
+    yields an array of row indices for every batch, taken from one permutation per epoch,
+    so the dataset can gather the whole batch with a single fancy index.
+    Used in a DataLoader with batch_size=None.
+    """
+
+    def __init__(self, data_source: Container, batch_size: int, shuffle: bool=True, chunk_size: int=0):
+        """
+        :param data_source: the dataset to sample
+        :param batch_size: amount of rows in a batch
+        :param shuffle: shuffle the rows every epoch
+        :param chunk_size: if bigger than 0, shuffle chunks of consecutive rows (see get_chunk_permutation)
+        """
+        assert batch_size > 0
+        self.data_source = data_source
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.chunk_size = chunk_size
+
+    def __len__(self) -> int:
+        return (len(self.data_source) + self.batch_size - 1) // self.batch_size
+
+    def get_permutation(self) -> np.ndarray:
+        """
+        :return: the order of the rows for an epoch
+        """
+        size = len(self.data_source)
+        if not self.shuffle:
+            return np.arange(size)
+        if self.chunk_size > 0:
+            return get_chunk_permutation(size, self.chunk_size)
+        return np.random.permutation(size)
+
+    def __iter__(self):
+        perm = self.get_permutation()
+        for start in range(0, len(perm), self.batch_size):
+            yield perm[start:start+self.batch_size]
 
 
-def vstack_collate_fn(batch: Container[np.ndarray]):
+class TensorBatchLoader:
     """
-    used in a DataLoader.collate_fn to stack the batch vertically
+    iterates batches of a dataset that is already stored as a tensor in the target device,
+    shuffling with torch.randperm every epoch. Used instead of a DataLoader
+    when the whole trainset fits in the device memory.
     """
-    return torch.from_numpy(np.vstack(batch))
+
+    def __init__(self, rows: torch.Tensor, batch_size: int, indices: Container[torch.Tensor]=None, shuffle: bool=True):
+        """
+        :param rows: tensor with all the rows of the dataset
+        :param batch_size: amount of rows in a batch
+        :param indices: tensors of row indices in the same device, each batch will return a tuple
+            with the rows of every one (used for the pairs), if none the batches are the rows themselves
+        :param shuffle: shuffle the rows every epoch
+        """
+        assert batch_size > 0
+        self.rows = rows
+        self.batch_size = batch_size
+        self.indices = indices
+        self.shuffle = shuffle
+
+    @classmethod
+    def from_dataset(cls, dataset: Container, batch_size: int, device: str=None, shuffle: bool=True) -> 'TensorBatchLoader':
+        """
+        create the loader moving the dataset to the device only once
+
+        :param dataset: InteractionDataset or InteractionPairDataset
+        """
+        if isinstance(dataset, InteractionPairDataset):
+            rows = torch.from_numpy(np.asarray(dataset.dataset)).to(device)
+            indices = tuple(torch.from_numpy(v.astype(np.int64)).to(device) for v in (dataset.positives, dataset.negatives))
+            return cls(rows, batch_size, indices, shuffle)
+        rows = torch.from_numpy(np.asarray(dataset)).to(device)
+        return cls(rows, batch_size, shuffle=shuffle)
+
+    @property
+    def size(self) -> int:
+        return len(self.indices[0]) if self.indices else len(self.rows)
+
+    def __len__(self) -> int:
+        return (self.size + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        size = self.size
+        device = self.rows.device
+        if self.shuffle:
+            perm = torch.randperm(size, device=device)
+        else:
+            perm = torch.arange(size, device=device)
+        for start in range(0, size, self.batch_size):
+            batch = perm[start:start+self.batch_size]
+            if self.indices:
+                yield tuple(self.rows[v[batch]] for v in self.indices)
+            else:
+                yield self.rows[batch]
 
 
 class BaseDatasetSource:
@@ -740,24 +1963,22 @@ class BaseDatasetSource:
 
         self._logger.info("normalizing ids...")
         mapping = self.trainset.normalize_ids()
-        self._logger.info("calculating user-item matrix...")
-        self.useritems = self.trainset.create_adjacency_submatrix()
-
         remove = min_item_interactions > 0 or min_user_interactions > 0
         if remove:
             self._logger.info("removing low interactions...")
-            ci = self.trainset.remove_low_items(self.useritems, min_item_interactions)
-            if ci > 0:
-                self._logger.info(f"removed {ci} interactions of items with less than {min_item_interactions} users")
-            cu = self.trainset.remove_low_users(self.useritems, min_user_interactions)
-            if cu > 0:
-                self._logger.info(f"removed {cu} interactions of users with less than {min_user_interactions} items")
-            if (cu > 0 or ci > 0):
-                self._logger.info("normalizing ids again...")
-                self.trainset.denormalize_ids(mapping)
-                mapping = self.trainset.normalize_ids()
-                self._logger.info("calculating user-item matrix again...")
-                self.useritems = self.trainset.create_adjacency_submatrix()
+            removed = self.trainset.remove_low_core(min_user_interactions, min_item_interactions)
+            if len(removed) > 0:
+                counts = "/".join(str(c) for c in removed)
+                self._logger.info(f"removed {sum(removed)} interactions of users with less than {min_user_interactions} items "
+                    f"and items with less than {min_item_interactions} users in {len(removed)} iterations ({counts})")
+                self._logger.info("compacting ids...")
+                mapping = self.trainset.compact_ids(mapping)
+
+        self._logger.info("calculating user-item matrix...")
+        self.useritems = self.trainset.create_adjacency_submatrix()
+
+        # record the column operations and build the columns only once
+        self.trainset.plan()
 
         if previous_item_col is None and hparams.should_have_interaction_context("previous"):
             self._logger.info("adding previous item column...")
@@ -806,13 +2027,17 @@ def load_model(path: str):
 class IdFinder:
     """
     given a container with ordered ids,
-    this class uses bisect to find the position of one.
+    this class uses binary search to find the position of one.
     It's useful to convert non-consecutive ids in a dataset
     into consecutive integers.
     """
 
     def __init__(self, data: Container=[], hash: bool=False):
-        self.data = data
+        """
+        :param data: sorted raw ids (hashed if hash is true)
+        :param hash: hash the values with hash_ids before finding them
+        """
+        self.data = np.asarray(data)
         self.__hash = hash
 
     def __len__(self):
@@ -820,18 +2045,40 @@ class IdFinder:
 
     def _fix(self, v):
         if self.__hash:
-            v = hash(v)
+            v = hash_ids([v])[0]
         elif not isinstance(v, int):
             v = int(v)
         return v
 
+    def _fix_many(self, values: np.ndarray) -> np.ndarray:
+        if self.__hash:
+            return hash_ids(values)
+        values = np.asarray(values)
+        if len(self.data) > 0 and values.dtype != self.data.dtype:
+            values = values.astype(self.data.dtype)
+        return values
+
     def find(self, v) -> int:
         v = self._fix(v)
-        id = bisect_left(self.data, v)
+        id = int(np.searchsorted(self.data, v))
         if not self._check(id, v):
             return None
         return id
 
+    def find_many(self, values: np.ndarray) -> np.ma.MaskedArray:
+        """
+        find the positions of multiple values
+
+        :param values: array of raw values
+        :return: masked array with the positions, masked where the value was not found
+        """
+        values = self._fix_many(values)
+        if len(self.data) == 0:
+            return np.ma.masked_all(len(values), dtype=np.int64)
+        ids = np.searchsorted(self.data, values)
+        np.minimum(ids, len(self.data) - 1, out=ids)
+        return np.ma.masked_array(ids, mask=self.data[ids] != values)
+
     def _check(self, id, v):
         return id >= 0 and id < len(self.data) and self.data[id] == v
 
@@ -841,17 +2088,61 @@ class IdFinder:
             return None
         return self.data[v]
 
+    def reverse_many(self, ids: np.ndarray) -> np.ma.MaskedArray:
+        """
+        get the values of multiple positions
+
+        :param ids: array of positions
+        :return: masked array with the values, masked where the position is out of range
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        missing = (ids < 0) | (ids >= len(self.data))
+        if len(self.data) == 0:
+            return np.ma.masked_all(len(ids), dtype=self.data.dtype)
+        return np.ma.masked_array(self.data[np.where(missing, 0, ids)], mask=missing)
+
 
-class IdGenerator(IdFinder):
+class IdGenerator:
     """
-    additional methods to add the ids
+    assigns incremental ids to values using a hash map,
+    it can be frozen into an IdFinder with the values sorted
     """
 
     def __init__(self, hash: bool=False):
-        super().__init__([], hash)
+        """
+        :param hash: hash the values with hash_ids before adding them
+        """
+        self.__ids: Dict[Any, int] = {}
+        self.__hash = hash
 
-    def add(self, v) -> None:
-        v = self._fix(v)
-        id = bisect_left(self.data, v)
-        if not self._check(id, v):
-            self.data.insert(id, v)
+    def __len__(self):
+        return len(self.__ids)
+
+    def __fix(self, v):
+        return hash_ids([v])[0] if self.__hash else v
+
+    def add(self, v) -> int:
+        """
+        :return: the id of the value
+        """
+        return self.__ids.setdefault(self.__fix(v), len(self.__ids))
+
+    def add_many(self, values: np.ndarray) -> np.ndarray:
+        """
+        :return: the ids of the values
+        """
+        if self.__hash:
+            values = hash_ids(values)
+        codes, uniques = factorize_values(np.asarray(values))
+        ids = np.array([self.__ids.setdefault(v, len(self.__ids)) for v in uniques], dtype=np.int64)
+        return ids[codes]
+
+    def find(self, v) -> int:
+        return self.__ids.get(self.__fix(v))
+
+    def freeze(self) -> IdFinder:
+        """
+        :return: IdFinder with the sorted values (the ids will be the sorted positions)
+        """
+        data = np.sort(np.array(list(self.__ids.keys())))
+        return IdFinder(data, self.__hash)
@@ -0,0 +1,133 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import tempfile
+import pandas as pd
+import scipy.sparse as sp
+from logging import Logger
+from typing import Any, Container, Dict
+from nnrecommend.hparams import HyperParameters
+from nnrecommend.dataset import BaseDatasetSource, InteractionDataset
+
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "nnrecommend")
+
+
+class CachedDatasetSource(BaseDatasetSource):
+    """
+    wraps a dataset source to store the loaded datasets on disk
+    the cache is keyed by the format version, the source files and the hparams that change the data,
+    and later loads memory map the saved datasets instead of processing the source again
+    """
+
+    # increase when the saved files or the dataset processing change
+    FORMAT_VERSION = 3
+
+    TRAINSET_DIR = "trainset"
+    TESTSET_DIR = "testset"
+    USERITEMS_FILE = "useritems.npz"
+    ITEMS_FILE = "items.pkl"
+    KEY_FILE = "key.json"
+    HPARAM_KEYS = ("interaction_context", "recommend", "max_interactions")
+
+    def __init__(self, src: BaseDatasetSource, path: str, cache_dir: str=DEFAULT_CACHE_DIR, random_seed: int=None, logger: Logger=None):
+        """
+        :param src: the dataset source to cache
+        :param path: path of the source files, used to calculate the cache key
+        :param cache_dir: directory where the cached datasets are stored
+        :param random_seed: random seed used when loading (random operations depend on it)
+        """
+        super().__init__(logger)
+        self.src = src
+        self.__path = path
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.__random_seed = random_seed
+
+    def __get_files(self) -> Container[str]:
+        path = self.__path
+        if os.path.isfile(path):
+            return [path]
+        if os.path.isdir(path):
+            # sources like spotify find their files in subdirectories
+            files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+        else:
+            # some sources use the path as a prefix of the files
+            files = glob.glob(glob.escape(path) + "*")
+        return sorted(f for f in files if os.path.isfile(f))
+
+    def get_key_data(self, hparams: HyperParameters) -> Dict[str, Any]:
+        """
+        data used to identify the cached datasets
+        """
+        files = []
+        for filepath in self.__get_files():
+            stat = os.stat(filepath)
+            files.append((filepath, stat.st_size, stat.st_mtime_ns))
+        return {
+            "version": self.FORMAT_VERSION,
+            "source": type(self.src).__name__,
+            "path": self.__path,
+            "files": files,
+            "hparams": {k: hparams.data.get(k) for k in self.HPARAM_KEYS},
+            "random_seed": self.__random_seed,
+        }
+
+    def get_cache_path(self, hparams: HyperParameters) -> str:
+        """
+        directory where the datasets for the given hparams are cached
+        """
+        data = json.dumps(self.get_key_data(hparams), sort_keys=True, default=str)
+        key = hashlib.sha1(data.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def clear(self) -> None:
+        """
+        remove all the cached datasets
+        """
+        if os.path.isdir(self.cache_dir):
+            self._logger.info(f"clearing dataset cache {self.cache_dir}...")
+            shutil.rmtree(self.cache_dir)
+
+    def __load_cache(self, path: str) -> None:
+        self.trainset = InteractionDataset.load(os.path.join(path, self.TRAINSET_DIR))
+        self.testset = InteractionDataset.load(os.path.join(path, self.TESTSET_DIR))
+        self.useritems = sp.load_npz(os.path.join(path, self.USERITEMS_FILE))
+        items_path = os.path.join(path, self.ITEMS_FILE)
+        self.items = pd.read_pickle(items_path) if os.path.exists(items_path) else None
+
+    def __is_cached(self, path: str) -> bool:
+        return os.path.isfile(os.path.join(path, self.KEY_FILE))
+
+    def __save_cache(self, path: str, key_data: Dict[str, Any]) -> None:
+        # write to a unique temporary directory first so an interrupted run does not leave a broken cache
+        # and concurrent runs (like parallel hparam trials) do not write to the same files
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmppath = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=self.cache_dir)
+        self.src.trainset.save(os.path.join(tmppath, self.TRAINSET_DIR))
+        self.src.testset.save(os.path.join(tmppath, self.TESTSET_DIR))
+        sp.save_npz(os.path.join(tmppath, self.USERITEMS_FILE), self.src.useritems.tocsr())
+        if self.src.items is not None:
+            pd.to_pickle(self.src.items, os.path.join(tmppath, self.ITEMS_FILE))
+        with open(os.path.join(tmppath, self.KEY_FILE), "w") as fh:
+            json.dump(key_data, fh, default=str)
+        try:
+            os.replace(tmppath, path)
+        except OSError:
+            # another run saved the same datasets first
+            shutil.rmtree(tmppath, ignore_errors=True)
+            if not self.__is_cached(path):
+                raise
+
+    def load(self, hparams: HyperParameters) -> None:
+        path = self.get_cache_path(hparams)
+        if self.__is_cached(path):
+            self._logger.info(f"loading cached dataset {path}...")
+            self.__load_cache(path)
+            return
+        self.src.load(hparams)
+        self._logger.info(f"saving dataset cache {path}...")
+        self.__save_cache(path, self.get_key_data(hparams))
+        self.src.trainset, self.src.testset = None, None
+        self.__load_cache(path)
@@ -77,8 +77,9 @@ class Movielens100kDatasetSource(BaseDatasetSource):
         data = data.drop([None], axis=1)
         mapping = IdFinder(mapping)
         data[self.ORIGINAL_ITEM_ID_COLUMN] = data[self.ITEM_ID_COLUMN].copy()
-        data[self.ITEM_ID_COLUMN] = data[self.ITEM_ID_COLUMN].apply(mapping.find)
-        data.dropna(subset=[self.ITEM_ID_COLUMN], inplace=True)
+        ids = mapping.find_many(data[self.ITEM_ID_COLUMN].to_numpy())
+        data[self.ITEM_ID_COLUMN] = ids.filled(-1)
+        data = data[~np.ma.getmaskarray(ids)]
         data.set_index(self.ITEM_ID_COLUMN, inplace=True)
         self._logger.info(f"loaded info for {len(data)} movies")
         return data
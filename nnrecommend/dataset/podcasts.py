@@ -5,7 +5,7 @@ from logging import Logger
 from sqlite3.dbapi2 import Connection
 from pandas.core.frame import DataFrame
 from nnrecommend.hparams import HyperParameters
-from nnrecommend.dataset import BaseDatasetSource, IdFinder, InteractionDataset
+from nnrecommend.dataset import BaseDatasetSource, ColumnNormalizer, InteractionDataset
 
 
 MIN_ITEM_INTERACTIONS = 1
@@ -20,39 +20,81 @@ class ItunesPodcastsDatasetSource(BaseDatasetSource):
         super().__init__(logger)
         self.__path = path
 
-    INTERACTIONS_QUERY = 'SELECT author_id, podcast_id FROM reviews WHERE rating == 5 ORDER BY created_at ASC'
-    ITEMS_QUERY = 'SELECT podcast_id, itunes_url, title FROM podcasts'
+    RATING = 5
+    FETCH_SIZE = 1 << 16
+    INDEX_QUERIES = (
+        'CREATE INDEX IF NOT EXISTS reviews_rating_author_podcast ON reviews (rating, author_id, podcast_id)',
+        'CREATE INDEX IF NOT EXISTS reviews_rating_podcast_author ON reviews (rating, podcast_id, author_id)',
+        'CREATE INDEX IF NOT EXISTS podcasts_podcast_id ON podcasts (podcast_id)',
+    )
+    ITEM_IDS_QUERY = """CREATE TEMP TABLE item_ids AS
+        SELECT podcast_id, ROW_NUMBER() OVER (ORDER BY podcast_id) - 1 AS id
+        FROM reviews WHERE rating == ? GROUP BY podcast_id HAVING COUNT(DISTINCT author_id) > ?"""
+    USER_IDS_QUERY = """CREATE TEMP TABLE user_ids AS
+        SELECT author_id, ROW_NUMBER() OVER (ORDER BY author_id) - 1 AS id
+        FROM reviews WHERE rating == ? GROUP BY author_id HAVING COUNT(DISTINCT podcast_id) > ?"""
+    INTERACTIONS_FROM = """FROM reviews r
+        JOIN user_ids u ON u.author_id = r.author_id
+        JOIN item_ids i ON i.podcast_id = r.podcast_id
+        WHERE r.rating == ?"""
+    INTERACTIONS_COUNT_QUERY = f'SELECT COUNT(*) {INTERACTIONS_FROM}'
+    INTERACTIONS_QUERY = f'SELECT u.id, i.id {INTERACTIONS_FROM} ORDER BY r.created_at ASC'
+    ITEMS_QUERY = """SELECT i.id AS podcast_id, p.itunes_url, p.title, p.podcast_id AS original_podcast_id
+        FROM podcasts p JOIN item_ids i ON i.podcast_id = p.podcast_id"""
     ITEM_ID_COLUMN = 'podcast_id'
     ORIGINAL_ITEM_ID_COLUMN = "original_podcast_id"
 
-    def __load_interactions(self, conn: Connection) -> None:
-        data = pd.read_sql(self.INTERACTIONS_QUERY, conn)
-        for colname in data.select_dtypes(exclude=int):
-            data[colname] = data[colname].apply(hash)
-        return data
+    def __create_ids(self, conn: Connection) -> None:
+        """
+        filter the users and items with low interactions (calculated on all the 5 star reviews)
+        and give them dense ids in temporary tables
+        """
+        for query in self.INDEX_QUERIES:
+            conn.execute(query)
+        conn.execute('DROP TABLE IF EXISTS temp.item_ids')
+        conn.execute('DROP TABLE IF EXISTS temp.user_ids')
+        conn.execute(self.ITEM_IDS_QUERY, (self.RATING, MIN_ITEM_INTERACTIONS))
+        conn.execute(self.USER_IDS_QUERY, (self.RATING, MIN_USER_INTERACTIONS))
+
+    def __load_interactions(self, conn: Connection) -> InteractionDataset:
+        n = conn.execute(self.INTERACTIONS_COUNT_QUERY, (self.RATING, )).fetchone()[0]
+        users = np.empty(n, dtype=np.int32)
+        items = np.empty(n, dtype=np.int32)
+        cursor = conn.execute(self.INTERACTIONS_QUERY, (self.RATING, ))
+        i = 0
+        while True:
+            rows = cursor.fetchmany(self.FETCH_SIZE)
+            if len(rows) == 0:
+                break
+            rows = np.array(rows, dtype=np.int32)
+            users[i:i+len(rows)] = rows[:, 0]
+            items[i:i+len(rows)] = rows[:, 1]
+            i += len(rows)
+        return InteractionDataset.from_columns([users, items, np.ones(n, dtype=np.uint8)])
 
     def __load_items(self, conn: Connection) -> DataFrame:
         data = pd.read_sql(self.ITEMS_QUERY, conn)
-        data[self.ORIGINAL_ITEM_ID_COLUMN] = data[self.ITEM_ID_COLUMN].copy()
-        data[self.ITEM_ID_COLUMN] = data[self.ITEM_ID_COLUMN].apply(hash)
         self._logger.info(f"loaded info for {len(data)} podcasts")
         return data
 
     def __fix_items(self, data: DataFrame, mapping: np.ndarray) -> DataFrame:
-        mapping = IdFinder(mapping)
-        data[self.ITEM_ID_COLUMN] = data[self.ITEM_ID_COLUMN].apply(mapping.find)
-        data.dropna(subset=[self.ITEM_ID_COLUMN], inplace=True)
+        ids, _, missing = ColumnNormalizer().normalize(data[self.ITEM_ID_COLUMN].to_numpy(), mapping)
+        data[self.ITEM_ID_COLUMN] = ids
+        data = data[~missing]
         data.set_index(self.ITEM_ID_COLUMN, inplace=True)
         self._logger.info(f"valid info for {len(data)} podcasts")
         return data
 
     def load(self, hparams: HyperParameters) -> None:
         with sqlite3.connect(self.__path) as conn:
+            self._logger.info("filtering interactions...")
+            self.__create_ids(conn)
             self._logger.info("loading interactions...")
-            interactions = self.__load_interactions(conn)
-            self.trainset = InteractionDataset(interactions, add_labels_col=True)
+            self.trainset = self.__load_interactions(conn)
             self._logger.info("loading items...")
             items = self.__load_items(conn)
+        # the queries already remove most of the low interactions in one pass,
+        # _setup repeats the filter until both limits hold
         mapping = self._setup(hparams, MIN_ITEM_INTERACTIONS, MIN_USER_INTERACTIONS)
         self._logger.info("fixing items...")
-        self.items = self.__fix_items(items, mapping[1])
\ No newline at end of file
+        self.items = self.__fix_items(items, mapping[1])
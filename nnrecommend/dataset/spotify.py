@@ -1,44 +1,270 @@
 from logging import Logger
 import os
+import glob
 import pandas as pd
 import numpy as np
 from pandas.core.frame import DataFrame
+from typing import Container, Tuple
+from concurrent.futures import ProcessPoolExecutor
 from nnrecommend.hparams import HyperParameters
-from nnrecommend.dataset import BaseDatasetSource, IdFinder, InteractionDataset
+from nnrecommend.dataset import BaseDatasetSource, IdFactorizer, IdFinder, InteractionDataset, GrowingArray, TopCounter, factorize_values, hash_ids
+from nnrecommend.logging import get_logger
 
 
 MIN_ITEM_INTERACTIONS = 1
 MIN_USER_INTERACTIONS = 3
 
 
+LOG_SESSION_COLUMN = "session_id"
+LOG_POSITION_COLUMN = "session_position"
+LOG_TRACK_COLUMN = "track_id_clean"
+LOG_SKIP_COLUMNS = ("skip_1", "skip_2", "skip_3", "not_skipped")
+LOG_NO_PREVIOUS_TRACK = ""
+
+
+def get_skip_values(skips: np.ndarray) -> np.ndarray:
+    """
+    the skip value is the index of the first skip column that is set
+    (the amount of skip columns if none is)
+
+    :param skips: boolean matrix with one column per skip level
+    """
+    return np.where(skips.any(axis=1), skips.argmax(axis=1), skips.shape[1])
+
+
+def count_spotify_log_sessions(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    count the interactions of every session in one of the log files of the full spotify dataset
+
+    :param path: path of the log csv file
+    :return: the hashed session ids and their counts
+    """
+    data = pd.read_csv(path, sep=',', usecols=[LOG_SESSION_COLUMN], dtype=str)
+    return np.unique(hash_ids(data[LOG_SESSION_COLUMN]), return_counts=True)
+
+
+def parse_spotify_log(path: str, load_skip: bool=True, load_prev: bool=True, sessions: np.ndarray=None) -> Tuple[np.ndarray, np.ndarray, Container[np.ndarray]]:
+    """
+    parse one of the log files of the full spotify dataset,
+    the ids are factorized in the file so the result is small to send between processes
+
+    :param path: path of the log csv file
+    :param sessions: sorted hashed session ids to keep (None to keep all)
+    :return: session uniques, track uniques and the columns (sessions, tracks, skips, previous tracks)
+        with the session and track columns containing positions in the uniques
+    """
+    cols = [LOG_SESSION_COLUMN, LOG_POSITION_COLUMN, LOG_TRACK_COLUMN]
+    if load_skip:
+        cols += LOG_SKIP_COLUMNS
+    dtype = {LOG_SESSION_COLUMN: str, LOG_TRACK_COLUMN: str}
+    data = pd.read_csv(path, sep=',', usecols=cols, dtype=dtype)
+    if sessions is not None:
+        data = data[np.isin(hash_ids(data[LOG_SESSION_COLUMN]), sessions)]
+    data.sort_values(by=[LOG_SESSION_COLUMN, LOG_POSITION_COLUMN], inplace=True, kind="stable")
+    # missing ids get their own unique like in IdFactorizer instead of -1
+    sessions, session_uniques = factorize_values(data[LOG_SESSION_COLUMN])
+    tracks = data[LOG_TRACK_COLUMN].to_numpy()
+    if load_prev:
+        # the tracks are factorized after a no previous track value so it gets the first id
+        tracks = np.concatenate(([LOG_NO_PREVIOUS_TRACK], tracks))
+    tracks, track_uniques = factorize_values(tracks)
+    columns = [sessions.astype(np.int32)]
+    if load_prev:
+        tracks = tracks[1:]
+    columns.append(tracks.astype(np.int32))
+    if load_skip:
+        skips = data[list(LOG_SKIP_COLUMNS)].to_numpy(dtype=bool)
+        columns.append(get_skip_values(skips).astype(np.int32))
+    if load_prev:
+        prevs = np.zeros(len(tracks), dtype=np.int32)
+        same = sessions[1:] == sessions[:-1]
+        prevs[1:] = np.where(same, tracks[:-1], 0)
+        columns.append(prevs)
+    return np.asarray(session_uniques), np.asarray(track_uniques), columns
+
+
+LOG_FILE_PATTERN = "log_*.csv"
+
+
+def find_spotify_logs(path: str) -> Container[str]:
+    """
+    find the log files of the full spotify dataset in a directory
+    """
+    pattern = os.path.join(path, "**", LOG_FILE_PATTERN)
+    paths = sorted(glob.glob(pattern, recursive=True))
+    if len(paths) == 0:
+        raise FileNotFoundError(f"could not find log files in {path}")
+    return paths
+
+
+def load_spotify_logs(paths: Container[str], load_skip: bool=True, load_prev: bool=True, sessions: np.ndarray=None,
+        max_workers: int=None, chunk_size: int=1 << 20) -> Container[np.ndarray]:
+    """
+    parse the log files in a process pool and merge the ids of every file into global ones
+
+    :param paths: paths of the log csv files
+    :param sessions: sorted hashed session ids to keep (None to keep all)
+    :param max_workers: amount of processes (None for all the cpus)
+    :return: the int32 columns (sessions, tracks, skips, previous tracks)
+    """
+    sessionids, trackids = IdFactorizer(), IdFactorizer()
+    if load_prev:
+        trackids(np.array([LOG_NO_PREVIOUS_TRACK], dtype=object))
+    n = len(paths)
+    buffers = None
+    with ProcessPoolExecutor(max_workers) as executor:
+        results = executor.map(parse_spotify_log, paths, [load_skip] * n, [load_prev] * n, [sessions] * n)
+        for session_uniques, track_uniques, columns in results:
+            session_map = sessionids(session_uniques)
+            track_map = trackids(track_uniques)
+            columns[0] = session_map[columns[0]]
+            columns[1] = track_map[columns[1]]
+            if load_prev:
+                columns[-1] = track_map[columns[-1]]
+            if buffers is None:
+                buffers = [GrowingArray(np.int32, chunk_size) for _ in columns]
+            for buffer, values in zip(buffers, columns):
+                buffer.extend(values)
+            del columns
+    return [buffer.finish() for buffer in buffers]
+
+
+def preselect_spotify_logs(path: str, output: str, amount: int, max_workers: int=None,
+        oversample: int=4, logger: Logger=None) -> InteractionDataset:
+    """
+    save the interactions of the sessions with most interactions in the log files
+    of the full spotify dataset, using bounded memory.
+    The first pass estimates the session counts with a count-min sketch keeping
+    the top candidates, the second pass loads the interactions of the candidates
+    and keeps the sessions with the highest exact counts.
+
+    :param path: directory with the log files
+    :param output: directory where the dataset is saved (can be loaded by SpotifyDatasetSource)
+    :param amount: amount of sessions to keep
+    :param oversample: the amount of candidates is amount*oversample
+    :return: the saved dataset
+    """
+    logger = logger or get_logger(preselect_spotify_logs)
+    paths = find_spotify_logs(path)
+    counter = TopCounter(amount * oversample)
+    logger.info(f"counting sessions in {len(paths)} log files...")
+    with ProcessPoolExecutor(max_workers) as executor:
+        for keys, counts in executor.map(count_spotify_log_sessions, paths):
+            counter.add(keys, counts)
+    candidates, _ = counter.top()
+    logger.info(f"loading interactions of {len(candidates)} candidate sessions from {counter.total} interactions...")
+    columns = load_spotify_logs(paths, sessions=np.sort(candidates), max_workers=max_workers)
+    counts = np.bincount(columns[0])
+    top = np.argsort(-counts, kind="stable")[:amount]
+    cond = np.isin(columns[0], top)
+    columns = [c[cond] for c in columns]
+    columns.append(np.ones(len(columns[0]), dtype=np.uint8))
+    logger.info(f"saving {len(columns[0])} interactions of {len(top)} sessions...")
+    dataset = InteractionDataset.from_columns(columns)
+    dataset.save(output)
+    return dataset
+
+
+def is_dataset_dir(path: str) -> bool:
+    """
+    check if the path is a directory with a saved InteractionDataset
+    """
+    return os.path.isfile(os.path.join(path, InteractionDataset.COLUMN_FILENAME.format(0)))
+
+
 class SpotifyDatasetSource(BaseDatasetSource):
     """
     this source loads a preprocessed dataset obtained from the big (56Gb) trainset found here
     https://www.aicrowd.com/challenges/spotify-sequential-skip-prediction-challenge/dataset_files
     the preprocessed dataset was obtained by estracting the users with the highest amount of interactions
+
+    if the path is a directory, the log_*.csv files of the original dataset inside it
+    are parsed in a process pool, using the sessions as users,
+    or the interactions saved by preselect_spotify_logs are loaded if found
     """
-    def __init__(self, path: str, logger: Logger=None):
+    USER_COLUMN = "user_id"
+    ITEM_COLUMN = "song_id"
+    SKIP_COLUMN = "skipped"
+    PREVIOUS_ITEM_COLUMN = "previous_song"
+    ID_DTYPES = {USER_COLUMN: str, ITEM_COLUMN: str, PREVIOUS_ITEM_COLUMN: str}
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, path: str, logger: Logger=None, max_workers: int=None):
+        """
+        :param max_workers: amount of processes used to parse the log files (None for all the cpus)
+        """
         super().__init__(logger)
         self.__path = path
+        self.max_workers = max_workers
 
-    def __load_data(self, load_skip: bool=True, load_prev: bool=True):
-        cols = ["user_id", "song_id"]
+    def __load_logs(self, load_skip: bool=True, load_prev: bool=True) -> InteractionDataset:
+        """
+        parse the log files in parallel and merge the ids of every file into global ones
+        """
+        paths = find_spotify_logs(self.__path)
+        self._logger.info(f"parsing {len(paths)} log files...")
+        columns = load_spotify_logs(paths, load_skip, load_prev, max_workers=self.max_workers, chunk_size=self.CHUNK_SIZE)
+        columns.append(np.ones(len(columns[0]), dtype=np.uint8))
+        return InteractionDataset.from_columns(columns)
+
+    def __load_preselected(self, load_skip: bool=True, load_prev: bool=True) -> InteractionDataset:
+        """
+        load the memory mapped interactions saved by preselect_spotify_logs
+        """
+        columns = InteractionDataset.load(self.__path).columns
+        session, track, skip, prev, label = columns
+        columns = [session, track]
         if load_skip:
-            cols.append("skipped")
+            columns.append(skip)
         if load_prev:
-            cols.append("previous_song")
-        data = pd.read_csv(self.__path, sep=',', usecols=cols)
-        for colname in data.select_dtypes(exclude=int):
-            data[colname] = data[colname].apply(hash)
-        return data
+            columns.append(prev)
+        columns.append(label)
+        return InteractionDataset.from_columns(columns)
+
+    def __load_data(self, load_skip: bool=True, load_prev: bool=True) -> InteractionDataset:
+        """
+        read the csv in chunks, factorizing the ids of every chunk
+        and appending them to compact column buffers
+        """
+        items = IdFactorizer()
+        factorizers = {
+            self.USER_COLUMN: IdFactorizer(),
+            self.ITEM_COLUMN: items,
+        }
+        if load_skip:
+            factorizers[self.SKIP_COLUMN] = None
+        if load_prev:
+            # previous songs share the song ids
+            factorizers[self.PREVIOUS_ITEM_COLUMN] = items
+        cols = list(factorizers.keys())
+        dtype = {k: v for k, v in self.ID_DTYPES.items() if k in factorizers}
+        buffers = [GrowingArray(np.int32, self.CHUNK_SIZE) for _ in cols]
+        chunks = pd.read_csv(self.__path, sep=',', usecols=cols, dtype=dtype, chunksize=self.CHUNK_SIZE)
+        for chunk in chunks:
+            for buffer, (colname, factorizer) in zip(buffers, factorizers.items()):
+                values = chunk[colname].to_numpy()
+                if factorizer is None:
+                    if not np.issubdtype(values.dtype, np.number) and values.dtype != bool:
+                        factorizer = factorizers[colname] = IdFactorizer()
+                if factorizer is not None:
+                    values = factorizer(values)
+                buffer.extend(values)
+            del chunk
+        columns = [buffer.finish() for buffer in buffers]
+        columns.append(np.ones(len(columns[0]), dtype=np.uint8))
+        return InteractionDataset.from_columns(columns)
 
     def load(self, hparams: HyperParameters) -> None:
         self._logger.info("loading interactions...")
         load_skip = hparams.should_have_interaction_context("skip")
         load_prev = hparams.should_have_interaction_context("previous")
-        interactions = self.__load_data(load_skip, load_prev)
-        self.trainset = InteractionDataset(interactions, add_labels_col=True)
-        prev_item_col = -2 # loaded from the dataset
+        if is_dataset_dir(self.__path):
+            self.trainset = self.__load_preselected(load_skip, load_prev)
+        elif os.path.isdir(self.__path):
+            self.trainset = self.__load_logs(load_skip, load_prev)
+        else:
+            self.trainset = self.__load_data(load_skip, load_prev)
+        prev_item_col = -2 if load_prev else None # loaded from the dataset
         self._setup(hparams, MIN_ITEM_INTERACTIONS, MIN_USER_INTERACTIONS, prev_item_col)
 
 
@@ -55,6 +281,7 @@ class SpotifyMiniDatasetSource(BaseDatasetSource):
     COLUMNS = (USER_COLUMN, ITEM_COLUMN, SORT_COLUMN)
     SKIP_COLUMNS = ("skip_1", "skip_2", "skip_3", "not_skipped")
     SKIP_COLUMN = "skip"
+    POSITION_COLUMN = "position"
     SORT_COLUMNS = (USER_COLUMN, SORT_COLUMN)
     ITEM_ID_COLUMN = "track_id"
     ORIGINAL_ITEM_ID_COLUMN = "original_track_id"
@@ -66,33 +293,36 @@ class SpotifyMiniDatasetSource(BaseDatasetSource):
         super().__init__(logger)
         self.__path = path
 
-    def __load_interactions(self, load_skip: bool=False) -> np.ndarray:
+    def __load_interactions(self, load_skip: bool=False, load_position: bool=False) -> np.ndarray:
         path = self.__path
         if os.path.isdir(path):
             path = os.path.join(path, self.FILENAME)
         cols = self.COLUMNS + self.SKIP_COLUMNS if load_skip else self.COLUMNS
         data = pd.read_csv(path, sep=',', usecols=cols)
         data.sort_values(by=list(self.SORT_COLUMNS), inplace=True, ascending=True)
-        del data[self.SORT_COLUMN]
-        for colname in data.select_dtypes(exclude=int):
-            data[colname] = data[colname].apply(hash)
+        for colname in data.select_dtypes(exclude=[np.number, bool]):
+            data[colname] = hash_ids(data[colname])
         if load_skip:
             data = self.__fix_skip(data)
+        if load_position:
+            data[self.POSITION_COLUMN] = self.__get_position_buckets(data[self.SORT_COLUMN].to_numpy())
+        del data[self.SORT_COLUMN]
         return data
 
     def __fix_skip(self, data: DataFrame) -> DataFrame:
-        def get_value(series):
-            c = 0
-            for v in series:
-                if v: break
-                c += 1
-            return c
         cols = list(self.SKIP_COLUMNS)
-        index = data.set_index(cols).index
-        data[self.SKIP_COLUMN] = index.map(get_value)
+        data[self.SKIP_COLUMN] = get_skip_values(data[cols].to_numpy(dtype=bool))
         data.drop(cols, axis=1, inplace=True)
         return data
 
+    def __get_position_buckets(self, positions: np.ndarray) -> np.ndarray:
+        """
+        bucket the position of the interaction in the session with a log2 scale
+        (1, 2-3, 4-7, 8-15...)
+        """
+        positions = np.maximum(positions, 1)
+        return np.floor(np.log2(positions)).astype(np.int64)
+
     def __load_items(self, mapping: np.ndarray) -> DataFrame:
         path = os.path.join(self.__path, self.ITEMS_FILENAME)
         if not os.path.isfile(path):
@@ -101,11 +331,11 @@ class SpotifyMiniDatasetSource(BaseDatasetSource):
         data = pd.read_csv(path, index_col=False)
 
         self._logger.info(f"loaded info for {len(data)} tracks")
-        mapping = IdFinder(mapping)
+        mapping = IdFinder(mapping, hash=True)
         data[self.ORIGINAL_ITEM_ID_COLUMN] = data[self.ITEM_ID_COLUMN].copy()
-        itemids = data[self.ITEM_ID_COLUMN]
-        data[self.ITEM_ID_COLUMN] = itemids.apply(hash).apply(mapping.find)
-        data.dropna(subset=[self.ITEM_ID_COLUMN], inplace=True)
+        ids = mapping.find_many(data[self.ITEM_ID_COLUMN].to_numpy())
+        data[self.ITEM_ID_COLUMN] = ids.filled(-1)
+        data = data[~np.ma.getmaskarray(ids)]
         data.set_index(self.ITEM_ID_COLUMN, inplace=True)
         self._logger.info(f"valid info for {len(data)} tracks")
         return data
@@ -113,7 +343,8 @@ class SpotifyMiniDatasetSource(BaseDatasetSource):
     def load(self, hparams: HyperParameters) -> None:
         self._logger.info("loading interactions...")
         load_skip = hparams.should_have_interaction_context("skip")
-        interactions = self.__load_interactions(load_skip)
+        load_position = hparams.should_have_interaction_context("position")
+        interactions = self.__load_interactions(load_skip, load_position)
         self.trainset = InteractionDataset(interactions, add_labels_col=True)
         mapping = self._setup(hparams, MIN_ITEM_INTERACTIONS, MIN_USER_INTERACTIONS)
         self._logger.info("loading track features...")
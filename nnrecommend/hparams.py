@@ -8,6 +8,8 @@ class HyperParameters:
 
     TRIALS_KEY = "trials"
     COMMON_KEY = "common"
+    # interaction contexts that need to be named, the "all" value does not add them
+    OPT_IN_INTERACTION_CONTEXTS = ("position",)
 
     @classmethod
     def load_trials(cls, cmdargs: None, path=None):
@@ -58,6 +60,10 @@ class HyperParameters:
         "train_loader_workers": 0,
         "test_loader_workers": 0,
         "recommend": False,
+        "shuffle_chunk_size": 0,
+        "dynamic_negatives": False,
+        "device_trainset": False,
+        "test_batch_size": 256,
     }
 
     def __init__(self, data: Dict = {}):
@@ -66,6 +72,8 @@ class HyperParameters:
                 data[k] = v
             elif v is not None:
                 data[k] = type(v)(data[k])
+        if data["device_trainset"] and data["dynamic_negatives"]:
+            raise ValueError("device_trainset can't be used with dynamic_negatives")
         self.data = data
 
     def copy(self, data: Dict=None):
@@ -116,6 +124,11 @@ class HyperParameters:
         """batchsize of the trainset dataloader"""
         return self.__get("batch_size")
 
+    @property
+    def test_batch_size(self):
+        """amount of test users (groups of candidates) evaluated in each testset batch"""
+        return self.__get("test_batch_size")
+
     @property
     def epochs(self):
         # TODO: check if this should be a hyper parameter or fixed
@@ -192,6 +205,30 @@ class HyperParameters:
         """
         return self.__get("test_loader_workers")
 
+    @property
+    def shuffle_chunk_size(self):
+        """
+        shuffle the trainset in chunks of this amount of consecutive rows
+        (0 shuffles all the rows, useful for memory mapped datasets)
+        """
+        return self.__get("shuffle_chunk_size")
+
+    @property
+    def dynamic_negatives(self):
+        """
+        draw new trainset negative samples for every batch
+        instead of storing them in the trainset
+        """
+        return self.__get("dynamic_negatives")
+
+    @property
+    def device_trainset(self):
+        """
+        move the whole trainset to the device once
+        and get the batches from it instead of using a DataLoader
+        """
+        return self.__get("device_trainset")
+
     def get_tensorboard_tag(self, defval: str, **kwargs) -> str:
         """
         get the tensorboard tag
@@ -220,9 +257,9 @@ class HyperParameters:
         parm = self.__get("interaction_context")
         if not parm:
             return False
-        if parm == "all":
-            return True
         v = str(v)
+        if parm == "all":
+            return v not in self.OPT_IN_INTERACTION_CONTEXTS
         if not isinstance(parm, (list, tuple)):
             parm = str(parm).split(",")
         return v in parm
@@ -3,6 +3,7 @@ import math
 from pandas.core.frame import DataFrame
 import torch
 import numpy as np
+import scipy.sparse as sp
 import os
 import tracemalloc
 from fuzzywuzzy import process
@@ -13,7 +14,7 @@ from torch.utils.data.dataloader import DataLoader
 from torch.utils.tensorboard import SummaryWriter
 from nnrecommend.hparams import HyperParameters
 from nnrecommend.logging import get_logger
-from nnrecommend.dataset import BaseDatasetSource, InteractionPairDataset, GroupingDataset, vstack_collate_fn
+from nnrecommend.dataset import BaseDatasetSource, InteractionPairDataset, GroupingDataset, NegativeSampler, NegativeSamplingDataset, BatchShuffleSampler, TensorBatchLoader, seed_worker
 
 
 def human_readable_size(size, decimal_places=2):
@@ -36,6 +37,7 @@ class Setup:
         self.src = src
         self._logger = logger or get_logger(self)
         self.__trace_memory = trace_memory
+        self.__dyntrainset = None
         self.__pairstrainset = None
         self.__groupstestset = None
 
@@ -92,17 +94,25 @@ class Setup:
 
         trainf, testf = 1.0, 1.0
 
-        self._logger.info("adding trainset negative sampling...")
-        trainlen = len(self.src.trainset)
-        traingroups = self.src.trainset.add_negative_sampling(hparams.negatives_train, self.src.useritems)
-        trainf = len(self.src.trainset) / trainlen
-        if hparams.pairwise_loss:
-            self._logger.info("generating trainset pairs...")
-            self.__pairstrainset = InteractionPairDataset(self.src.trainset, traingroups)
+        sampler = NegativeSampler(self.src.useritems)
+        self.__dyntrainset, self.__pairstrainset = None, None
+        if hparams.dynamic_negatives and hparams.negatives_train > 0:
+            self._logger.info("using dynamic trainset negative sampling...")
+            self.__dyntrainset = NegativeSamplingDataset(self.src.trainset, sampler, hparams.negatives_train, hparams.pairwise_loss)
+        else:
+            self._logger.info("adding trainset negative sampling...")
+            trainlen = len(self.src.trainset)
+            traingroups = self.src.trainset.add_negative_sampling(hparams.negatives_train, sampler)
+            trainf = len(self.src.trainset) / trainlen
+            if sampler.draws > 0:
+                self._logger.info(f"negative sampling rejected {sampler.rejections} of {sampler.draws} candidates ({100*sampler.rejection_rate:.2f}%)")
+            if hparams.pairwise_loss:
+                self._logger.info("generating trainset pairs...")
+                self.__pairstrainset = InteractionPairDataset(self.src.trainset, traingroups)
 
         self._logger.info("adding testset negative sampling...")
         testlen = len(self.src.testset)
-        testgroups = self.src.testset.add_negative_sampling(hparams.negatives_test, self.src.useritems, unique=True)
+        testgroups = self.src.testset.add_negative_sampling(hparams.negatives_test, sampler, unique=True)
         testf = len(self.src.testset) / testlen
         self.__groupstestset = GroupingDataset(self.src.testset, testgroups)
 
@@ -114,17 +124,35 @@ class Setup:
     def create_testloader(self, hparams: HyperParameters):
         if self.__groupstestset:
             dataset = self.__groupstestset
-            batch_size = 1
-            collate = vstack_collate_fn
+            batch_size = hparams.test_batch_size
         else:
             dataset = self.src.testset
             batch_size = hparams.batch_size
-            collate = None
-        return DataLoader(dataset, batch_size=batch_size, shuffle=True, collate_fn=collate, num_workers=hparams.test_loader_workers)
+        sampler = BatchShuffleSampler(dataset, batch_size, shuffle=False)
+        return self.__create_batchloader(dataset, sampler, hparams.test_loader_workers)
 
-    def create_trainloader(self, hparams: HyperParameters):
-        dataset = self.__pairstrainset if self.__pairstrainset else self.src.trainset
-        return DataLoader(dataset, batch_size=hparams.batch_size, shuffle=True, num_workers=hparams.train_loader_workers)
+    def __create_batchloader(self, dataset, sampler: BatchShuffleSampler, num_workers: int):
+        """
+        the sampler yields the indices of a whole batch,
+        so the dataset gathers it with one index and the loader only converts it to a tensor
+        """
+        return DataLoader(dataset, batch_size=None, sampler=sampler, num_workers=num_workers, worker_init_fn=seed_worker)
+
+    def create_trainloader(self, hparams: HyperParameters, device: str=None):
+        batch_size = hparams.batch_size
+        if self.__dyntrainset:
+            dataset = self.__dyntrainset
+            # every row returns the positive with its negatives
+            batch_size = max(1, batch_size // dataset.samples_per_row)
+        elif self.__pairstrainset:
+            dataset = self.__pairstrainset
+        else:
+            dataset = self.src.trainset
+        if hparams.device_trainset:
+            self._logger.info(f"moving the trainset to the {device or 'cpu'} device...")
+            return TensorBatchLoader.from_dataset(dataset, batch_size, device)
+        sampler = BatchShuffleSampler(dataset, batch_size, chunk_size=hparams.shuffle_chunk_size)
+        return self.__create_batchloader(dataset, sampler, hparams.train_loader_workers)
 
     def create_adjacency_matrix(self, hparams: HyperParameters):
         self._logger.info("creating adjacency matrix...")
@@ -150,6 +178,7 @@ class Trainer:
 
     def __forward(self, rows):
         if self.device:
+            # no copy for batches that are already in the device (see device_trainset)
             rows = rows.to(self.device)
         interactions = rows[:,:-1].long()
         targets = rows[:,-1].float()
@@ -225,23 +254,34 @@ class Tester:
         self.topk = topk
         self.device = device
 
-    def __get_hit_ratio(self, ranking: torch.Tensor, item: torch.Tensor) -> int:
+    def __get_hit_ratio(self, hits: torch.Tensor) -> torch.Tensor:
         """
         measures wether the test item is in the topk positions of the ranking
+
+        :param hits: boolean tensor of shape (users, topk), true where the ranking has the test item
         """
-        return 1 if item in ranking else 0
+        return hits.any(dim=1).float()
 
-    def __get_ndcg(self, ranking: torch.Tensor, item: torch.Tensor) -> int:
+    def __get_ndcg(self, hits: torch.Tensor) -> torch.Tensor:
         """
         normalized discounted cumulative gain
         measures the ranking quality with gives information about where in the ranking our test item is
+
+        :param hits: boolean tensor of shape (users, topk), true where the ranking has the test item
         """
-        idx = (ranking == item).nonzero(as_tuple=True)[0]
-        return math.log(2)/math.log(idx[0]+2) if len(idx) > 0 else 0
+        # argmax returns the first hit
+        idx = hits.float().argmax(dim=1)
+        ndcg = math.log(2) / torch.log(idx.double() + 2)
+        return torch.where(hits.any(dim=1), ndcg, torch.zeros_like(ndcg))
 
     @torch.no_grad()
     def __call__(self) -> TestResult:
-        hr, ndcg = [], []
+        """
+        the batches have shape (users, candidates, fields) with the test item first in every user,
+        candidates with negative labels are padding and are not ranked.
+        a batch with shape (candidates, fields) is evaluated as one user
+        """
+        hr, ndcg, count = 0.0, 0.0, 0
 
         total_recommended_items = set()
         total_items = set()
@@ -250,22 +290,32 @@ class Tester:
         for batch in self.testloader:
             if batch is None or batch.shape[0] == 0:
                 continue
-            total_items.update(batch[:, 1].tolist())
+            if batch.ndim == 2:
+                batch = batch.unsqueeze(0)
             if self.device:
                 batch = batch.to(self.device)
-            interactions = batch[:, :-1].long()
-            real_item = interactions[0][1]
-            predictions = self.model(interactions)
-            _, indices = torch.topk(predictions, self.topk)
-            recommended_items = interactions[indices][:, 1]
-            total_recommended_items.update(recommended_items.tolist())
-            hr.append(self.__get_hit_ratio(recommended_items, real_item))
-            ndcg.append(self.__get_ndcg(recommended_items, real_item))
+            nusers, ncandidates, nfields = batch.shape
+            valid = batch[:, :, -1] >= 0
+            interactions = batch[:, :, :-1].long()
+            items = interactions[:, :, 1]
+            total_items.update(torch.unique(items[valid]).tolist())
+            predictions = self.model(interactions.reshape(-1, nfields - 1)).reshape(nusers, ncandidates)
+            predictions = predictions.masked_fill(~valid, -math.inf)
+            _, indices = torch.topk(predictions, min(self.topk, ncandidates), dim=1)
+            recommended_items = items.gather(1, indices)
+            recommended_valid = valid.gather(1, indices)
+            total_recommended_items.update(torch.unique(recommended_items[recommended_valid]).tolist())
+            hits = (recommended_items == items[:, :1]) & recommended_valid
+            # users without candidates are not evaluated
+            users = valid[:, 0]
+            hr += self.__get_hit_ratio(hits)[users].sum().item()
+            ndcg += self.__get_ndcg(hits)[users].sum().item()
+            count += int(users.sum().item())
             del batch
             freemem()
 
         cov = len(total_recommended_items) / len(total_items)
-        return TestResult(self.topk, statistics.mean(hr), statistics.mean(ndcg), cov)
+        return TestResult(self.topk, hr / count, ndcg / count, cov)
 
 
 class RunTracker:
@@ -376,6 +426,20 @@ class Finder:
             return FinderResult(best[2], best[3], best[0], best[1])
 
 
+def get_user_items(matrix: sp.spmatrix, user: int, idrange: np.ndarray) -> np.ndarray:
+    """
+    get the items a user interacted with from the user-item matrix
+
+    :param matrix: adjacency matrix with the users in the rows (any scipy sparse format)
+    :param user: the user id
+    :param idrange: the id ranges of the dataset
+    :return: array with the item ids starting with 0
+    """
+    row = matrix.tocsr()[user]
+    row.eliminate_zeros()
+    return row.indices.astype(np.int64) - idrange[0]
+
+
 class Recommender:
 
     def __init__(self, idrange: np.ndarray, items: DataFrame, model: Callable, device: str=None):
@@ -1,6 +1,11 @@
 import numpy as np
+import torch
+import pickle
 import pytest
-from nnrecommend.dataset import InteractionDataset, InteractionPairDataset
+import scipy.sparse as sp
+from nnrecommend.dataset import InteractionDataset, InteractionPairDataset, NegativeSamplingDataset, GroupingDataset, ColumnNormalizer, NegativeSampler, BatchShuffleSampler, TensorBatchLoader, BaseDatasetSource, IdFactorizer, GrowingArray, TopCounter, IdFinder, IdGenerator, hash_ids, get_chunk_permutation
+from nnrecommend.dataset.cache import CachedDatasetSource
+from nnrecommend.hparams import HyperParameters
 
 
 def test_dataset():
@@ -36,6 +41,24 @@ def test_dataset_denormalize():
     assert (dataset[2] == (4, 1, 1)).all()
 
 
+def test_dataset_compact():
+    data = ((2, 2), (3, 1), (4, 1), (4, 7), (5, 2))
+    dataset = InteractionDataset(data)
+    mapping = dataset.normalize_ids()
+    matrix = dataset.create_adjacency_matrix()
+    dataset.remove_low_items(matrix, 1)
+    assert len(dataset) == 4
+    expected = InteractionDataset(dataset[:].copy())
+    expected.idrange = dataset.idrange.copy()
+    expected.denormalize_ids(mapping)
+    expected_mapping = expected.normalize_ids()
+    mapping = dataset.compact_ids(mapping)
+    assert (dataset.idrange == expected.idrange).all()
+    assert (dataset[:] == expected[:]).all()
+    for colmapping, expected_colmapping in zip(mapping, expected_mapping):
+        assert (colmapping == expected_colmapping).all()
+
+
 def test_dataset_pass_mapping():
     data = ((2, 2), (3, 1))
     dataset = InteractionDataset(data)
@@ -54,13 +77,37 @@ def test_dataset_bad_mapping():
     assert (dataset[0] == (1, 3, 1)).all()
 
 
+def test_column_normalizer():
+    data = np.array(((2, 2, 1), (3, 1, 1), (4, 5, 1)))
+    normalizer = ColumnNormalizer(max_workers=2)
+    mapping, missing = normalizer(data, ((2, 3), (1, 2, 5)))
+    assert (missing == (False, False, True)).all()
+    assert (data[0] == (0, 3, 1)).all()
+    assert (data[1] == (1, 2, 1)).all()
+    assert (mapping[1] == (1, 2, 5)).all()
+    columns = (np.array((2, 3, 4)), np.array((2, 1, 5)))
+    ids, mapping, missing = normalizer.normalize_columns(columns, ((2, 3), (1, 2, 5)))
+    assert (missing == (False, False, True)).all()
+    assert (ids[0][:2] == (0, 1)).all()
+    assert (ids[1][:2] == (1, 0)).all()
+    ids, colmapping, missing = normalizer.normalize(np.array((7, 3, 7)), minv=2)
+    assert (ids == (3, 2, 3)).all()
+    assert (colmapping == (3, 7)).all()
+    assert not missing.any()
+
+
 def test_adjacency_matrix():
     data = ((2, 2), (3, 1))
     dataset = InteractionDataset(data)
-    matrix = dataset.create_adjacency_matrix()
+    matrix = dataset.create_adjacency_matrix(format="dok")
     assert (0, 3) in matrix
     assert (0, 2) not in matrix
     assert (1, 2) in matrix
+    matrix = dataset.create_adjacency_matrix()
+    assert matrix.format == "csr"
+    assert matrix[0, 3] == 1
+    assert matrix[0, 2] == 0
+    assert matrix[1, 2] == 1
     assert (dataset[0] == (0, 3, 1)).all()
     nitems = dataset.get_random_negative_rows(dataset[0], 3, matrix)
     assert nitems.shape[0] == 3
@@ -83,6 +130,52 @@ def test_add_negative_sampling():
     assert (dataset[5] == (1, 3, 0)).all()
 
 
+@pytest.mark.parametrize("chunk_size", (None, 1, 2))
+def test_adjacency_matrix_weighted(chunk_size):
+    data = ((2, 2, 0), (3, 1, 1), (2, 2, 1), (2, 2, 1))
+    dataset = InteractionDataset(data)
+    matrix = dataset.create_adjacency_matrix(format="dok", weighted=True, chunk_size=chunk_size)
+    assert matrix.format == "dok"
+    assert matrix[0, 3] == 3
+    assert matrix[3, 0] == 3
+    assert matrix[1, 2] == 1
+    assert matrix.getnnz() == 4
+    matrix = dataset.create_adjacency_matrix(chunk_size=chunk_size)
+    assert matrix[0, 3] == 1
+    submatrix = dataset.create_adjacency_submatrix(half=True, weighted=True, chunk_size=chunk_size)
+    assert submatrix.shape == (2, 2)
+    assert submatrix[0, 1] == 3
+    assert submatrix[1, 0] == 1
+    assert submatrix.sum() == 4
+
+
+def test_negative_sampler():
+    data = ((0, 0), (0, 1), (1, 2), (2, 0))
+    dataset = InteractionDataset(data)
+    matrix = dataset.create_adjacency_matrix()
+    sampler = NegativeSampler(matrix)
+    assert (sampler.contains((0, 0, 1), (3, 5, 4)) == (True, False, False)).all()
+    assert (0, 4) in sampler
+    users = dataset[:, 0]
+    items = dataset[:, 1]
+    nitems = sampler(users, items, 20, 3, 6)
+    assert nitems.shape == (4, 20)
+    assert not sampler.contains(np.repeat(users, 20), nitems.reshape(-1)).any()
+    assert ((nitems >= 3) & (nitems < 6)).all()
+    assert sampler.draws >= 80
+    assert sampler.rejections == sampler.draws - 80
+    assert 0 < sampler.rejection_rate < 1
+
+
+def test_negative_sampler_keys():
+    # repeated coordinates and explicitly stored zeros
+    matrix = sp.coo_matrix(((1, 1, 0, 2), ((0, 0, 1, 2), (1, 1, 2, 0))), shape=(3, 3))
+    sampler = NegativeSampler(matrix)
+    assert (sampler.contains((0, 1, 2, 0), (1, 2, 0, 0)) == (True, False, True, False)).all()
+    assert (sampler.get_excluded(0, 2, 0, 3) == (1, 2)).all()
+    assert (sampler.sample_unique(0, 2, -1, 0, 3) == (0, )).all()
+
+
 def test_add_unique_negative_sampling():
     data = ((2, 2), (3, 1))
     dataset = InteractionDataset(data)
@@ -132,6 +225,53 @@ def test_get_unique_random_negative_items(size):
     assert len(np.unique(items)) == size
     
 
+@pytest.mark.parametrize("size", (1, 5, 8, 9))
+def test_sample_unique_small_catalogue(size):
+    data = ((0, 1), (0, 4), (0, 7))
+    dataset = InteractionDataset(data)
+    matrix = dataset.create_adjacency_matrix()
+    dataset.idrange[1] = 14
+    sampler = NegativeSampler(matrix)
+    # 13 items, 3 seen by the user and 1 as the positive item
+    items = sampler.sample_unique(0, 5, size, 1, 14)
+    assert len(items) == size
+    assert len(np.unique(items)) == size
+    assert not np.isin(items, (1, 2, 3, 5)).any()
+    assert ((items >= 1) & (items < 14)).all()
+    assert (sampler.sample_unique(0, 5, -1, 1, 14) == (4, 6, 7, 8, 9, 10, 11, 12, 13)).all()
+    with pytest.raises(ValueError):
+        sampler.sample_unique(0, 5, 10, 1, 14)
+    items = sampler.sample_unique(0, 5, 10, 1, 14, fail_if_less=False)
+    assert (np.sort(items) == (4, 6, 7, 8, 9, 10, 11, 12, 13)).all()
+    items = dataset.get_unique_random_negative_items(0, 5, 10, matrix)
+    assert len(items) == 9
+
+
+def test_sample_unique_many():
+    data = ((0, 1), (0, 4), (0, 7), (1, 2), (2, 3))
+    dataset = InteractionDataset(data)
+    matrix = dataset.create_adjacency_submatrix()
+    dataset.idrange[1] = 3 + 40
+    sampler = NegativeSampler(matrix)
+    users = np.array((0, 0, 1, 2, 5))
+    items = np.array((3, 20, 4, 50, 6))
+    available = sampler.count_available(users, items, 3, 43)
+    expected = [40 - len(sampler.get_excluded(u, i, 3, 43)) for u, i in zip(users, items)]
+    assert (available == expected).all()
+    result = sampler.sample_unique_many(users, items, 15, 3, 43)
+    assert result.shape == (5, 15)
+    for user, item, row in zip(users, items, result):
+        assert len(np.unique(row)) == 15
+        assert item not in row
+        assert not sampler.contains(np.full(15, user), row).any()
+        assert ((row >= 3) & (row < 43)).all()
+    assert (available == (37, 36, 39, 39, 39)).all()
+    result = sampler.sample_unique_many(users[:1], items[:1], 37, 3, 43)
+    assert (np.sort(result[0]) == np.setdiff1d(np.arange(3, 43), (3, 6, 7))).all()
+    with pytest.raises(ValueError):
+        sampler.sample_unique_many(users, items, 37, 3, 43)
+
+
 def test_extract_negative_dataset():
     data = ((2, 2), (3, 1))
     dataset = InteractionDataset(data)
@@ -158,6 +298,25 @@ def test_extract_test_dataset():
     assert len(testset) == 2
 
 
+@pytest.mark.parametrize("take_bottom", (True, False))
+def test_get_test_indices(take_bottom):
+    data = ((2, 2), (3, 1), (2, 3), (3, 4), (2, 1), (4, 1), (2, 4))
+    dataset = InteractionDataset(data)
+    rows = dataset.get_test_indices(2, 1, take_bottom)
+    if take_bottom:
+        assert (rows == (4, 6)).all()
+    else:
+        assert (rows == (0, 2)).all()
+    rows = dataset.get_test_indices(1, 1, take_bottom)
+    if take_bottom:
+        assert (rows == (3, 6)).all()
+    else:
+        assert (rows == (0, 1)).all()
+    testset = dataset.extract_test_dataset(2, 1, take_bottom)
+    assert len(testset) == 2
+    assert len(dataset) == 5
+
+
 def test_remove_low():
     data = ((2, 2), (2, 3), (3, 1), (3, 4), (4, 1))
     dataset = InteractionDataset(data)
@@ -216,6 +375,20 @@ def test_add_prev_item():
     assert (dataset[4] == (1, 6, 11, 1)).all()
 
 
+def test_add_prev_items_window():
+    data = ((2, 2), (2, 3), (3, 4), (4, 1), (3, 4), (2, 1))
+    dataset = InteractionDataset(data)
+    dataset.add_previous_items_columns(2)
+    assert dataset[0].shape[0] == 5
+    assert (dataset.idrange == (3, 7, 12, 17)).all()
+    assert (dataset[0] == (0, 4, 7, 12, 1)).all()
+    assert (dataset[1] == (0, 5, 9, 12, 1)).all()
+    assert (dataset[2] == (1, 6, 7, 12, 1)).all()
+    assert (dataset[3] == (2, 3, 7, 12, 1)).all()
+    assert (dataset[4] == (1, 6, 11, 12, 1)).all()
+    assert (dataset[5] == (0, 3, 10, 14, 1)).all()
+
+
 def test_pair_dataset():
     data = ((2, 2), (3, 1), (4, 3), (4, 2))
     dataset = InteractionDataset(data)
@@ -238,6 +411,21 @@ def test_pair_dataset():
     assert (dataset[5][0] == (2, 4, 1)).all()
     assert (dataset[5][1] == (2, 3, 0)).all()
 
+    pos, neg = dataset[np.array((1, 4))]
+    assert (pos == ((0, 4, 1), (2, 5, 1))).all()
+    assert (neg == ((0, 5, 0), (2, 3, 0))).all()
+
+
+def test_pair_dataset_groups():
+    data = np.arange(12).reshape(6, 2)
+    groups = [np.array((0, 3, 4)), np.array((1, )), np.array((2, 5))]
+    dataset = InteractionPairDataset(data, groups)
+    assert (dataset.positives == (0, 0, 2)).all()
+    assert (dataset.negatives == (3, 4, 5)).all()
+    dataset = InteractionPairDataset(data, np.array(((0, 3, 4), (2, 5, 1))))
+    assert (dataset.positives == (0, 0, 2, 2)).all()
+    assert (dataset.negatives == (3, 4, 5, 1)).all()
+
 
 def test_combine_columns():
     data = ((2, 2, 1, 1), (3, 1, 5, 1))
@@ -252,6 +440,29 @@ def test_combine_columns():
     assert dataset.idrange[1] == 6
 
 
+def test_combine_columns_before_base():
+    data = ((1, 2, 1, 1), (2, 1, 3, 1), (1, 1, 2, 1))
+    dataset = InteractionDataset(data)
+    dataset.normalize_ids()
+    assert (dataset.idrange == (2, 4, 7)).all()
+    rows = dataset[:]
+    dataset.combine_columns(1, 0)
+    assert (dataset.idrange == (4, 7)).all()
+    combined = dataset[:]
+    assert (combined[:, 0] == rows[:, 1] - 2 + rows[:, 0] * 2).all()
+    assert (combined[:, 1:] == rows[:, 2:]).all()
+
+
+def test_combine_columns_large_range():
+    users = (np.arange(600) % 256).astype(np.uint8)
+    items = (np.arange(600) % 300).astype(np.uint16)
+    dataset = InteractionDataset.from_columns([users, items, np.ones(600, dtype=np.uint8)], (256, 556))
+    dataset.combine_columns(1, 0)
+    assert (dataset.idrange == (76800, )).all()
+    # 255 * 300 overflows the uint16 that older numpy versions give to the uint8 column product
+    assert (dataset[:][:, 0] == items + users.astype(np.int64) * 300).all()
+
+
 def test_remove_column():
     data = ((2, 2), (2, 1), (1, 3), (1, 2))
     dataset = InteractionDataset(data)
@@ -297,6 +508,15 @@ def test_counts():
     counts = dataset.get_counts()
     assert (counts == (2, 3, 2, 1, 3, 3)).all()
 
+
+def test_counts_columns():
+    data = ((2, 2, 0), (2, 1, 1), (2, 2, 1), (1, 2, 0), (2, 1, 1), (2, 1, 1))
+    dataset = InteractionDataset(data, add_labels_col=True)
+    assert (dataset.get_counts((0, 2)) == (1, 4, 4, 1, 4, 4)).all()
+    assert (dataset.get_counts((0, 1, 2)) == (1, 3, 1, 1, 3, 3)).all()
+    assert (dataset.get_counts((1,)) == (3, 3, 3, 3, 3, 3)).all()
+
+
 def test_swap_columns():
     data = ((2, 2), (3, 1))
     dataset = InteractionDataset(data)
@@ -317,3 +537,275 @@ def test_prepare_for_recommend():
     assert (dataset.idrange == (4, 8)).all()
     assert (dataset[0] == (1, 6, 1)).all()
     assert (dataset[1] == (3, 7, 1)).all()
+
+
+def test_columnar_storage():
+    data = ((2, 2, 4), (2, 3, 5), (3, 4, 4), (4, 1, 5), (3, 4, 6), (2, 1, 4))
+    dataset = InteractionDataset(data, add_labels_col=True)
+    dataset.normalize_ids()
+    assert (dataset.idrange == (3, 7, 10)).all()
+    assert [c.dtype for c in dataset.columns] == [np.uint8] * 4
+    assert dataset.dtype == np.int32
+    assert (dataset[2] == (1, 6, 7, 1)).all()
+    assert (dataset[1:3, 1] == (5, 6)).all()
+    assert (dataset[[0, 3], :2] == ((0, 4), (2, 3))).all()
+    assert (dataset.get_grounded()[2] == (1, 3, 0, 1)).all()
+    dataset.swap_columns(0, 2)
+    dataset.swap_columns(0, 2)
+    dataset.prepare_for_recommend()
+    assert (dataset.idrange == (4, 7, 11)).all()
+    assert (dataset[:] == ((1, 5, 9, 1), (3, 6, 10, 1), (2, 4, 7, 1))).all()
+    data = np.array(((1, 2, 0.5), (2, 1, 1.0)))
+    dataset = InteractionDataset(data)
+    dataset.normalize_ids()
+    assert dataset.dtype == np.float64
+    assert (dataset[0] == (0, 3, 0.5)).all()
+
+
+def test_memory_mapped_dataset(tmp_path):
+    data = ((2, 2, 4), (2, 3, 5), (3, 4, 4), (4, 1, 5), (3, 4, 6), (2, 1, 4))
+    dataset = InteractionDataset(data, add_labels_col=True)
+    dataset.normalize_ids()
+    dataset.save(str(tmp_path))
+    mapped = InteractionDataset.load(str(tmp_path))
+    assert mapped.mapped
+    assert len(mapped) == len(dataset)
+    assert (mapped.idrange == dataset.idrange).all()
+    assert (mapped[:] == dataset[:]).all()
+    unpickled = pickle.loads(pickle.dumps(mapped))
+    assert unpickled.mapped
+    assert (unpickled[[5, 1]] == dataset[[5, 1]]).all()
+    matrix = mapped.create_adjacency_submatrix()
+    mapped.add_negative_sampling(2, matrix)
+    assert len(mapped) == 3 * len(dataset)
+    assert not mapped.mapped
+    indices = get_chunk_permutation(len(dataset), 4).tolist()
+    assert sorted(indices) == list(range(len(dataset)))
+    assert set(indices[:2]) == {4, 5} or set(indices[-2:]) == {4, 5}
+
+
+class MemoryDatasetSource(BaseDatasetSource):
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+        self.loads = 0
+
+    def load(self, hparams: HyperParameters) -> None:
+        self.loads += 1
+        self.trainset = InteractionDataset(self.data, add_labels_col=True)
+        self._setup(hparams)
+
+
+def test_cached_dataset_source(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_text("data")
+    data = ((2, 2), (2, 3), (3, 4), (4, 1), (3, 2), (2, 1))
+    src = MemoryDatasetSource(data)
+    hparams = HyperParameters({"interaction_context": None})
+    cached = CachedDatasetSource(src, str(path), str(tmp_path / "cache"))
+    cached.load(hparams)
+    cached.load(hparams)
+    assert src.loads == 1
+    assert cached.trainset.mapped
+    # only the complete cache is left in the directory
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+    src.load(hparams)
+    assert (cached.trainset[:] == src.trainset[:]).all()
+    assert (cached.testset[:] == src.testset[:]).all()
+    assert (cached.useritems != src.useritems).nnz == 0
+    cached.load(HyperParameters({"interaction_context": None, "max_interactions": 4}))
+    assert src.loads == 3
+    path.write_text("changed")
+    cached.load(hparams)
+    assert src.loads == 4
+    cached.clear()
+    cached.load(hparams)
+    assert src.loads == 5
+
+    # the files in subdirectories are part of the key
+    logs = tmp_path / "spotify" / "logs"
+    logs.mkdir(parents=True)
+    (logs / "log_0.csv").write_text("data")
+    cached = CachedDatasetSource(src, str(tmp_path / "spotify"), str(tmp_path / "cache"))
+    key = cached.get_cache_path(hparams)
+    (logs / "log_1.csv").write_text("data")
+    assert cached.get_cache_path(hparams) != key
+
+
+def test_id_factorizer():
+    factorizer = IdFactorizer()
+    assert (factorizer(np.array(("b", "a", "b"), dtype=object)) == (0, 1, 0)).all()
+    assert (factorizer(np.array(("c", "a", None), dtype=object)) == (2, 1, 3)).all()
+    assert len(factorizer) == 4
+    assert list(factorizer.uniques[:3]) == ["b", "a", "c"]
+    assert (factorizer(np.array((np.nan, "d", "b"), dtype=object)) == (3, 4, 0)).all()
+    assert list(factorizer.uniques[[0, 4]]) == ["b", "d"]
+    chunks = np.array_split(np.arange(1000) % 37, 10)
+    factorizer = IdFactorizer()
+    ids = np.concatenate([factorizer(chunk) for chunk in chunks])
+    assert len(factorizer) == 37
+    assert (factorizer.uniques[ids] == np.arange(1000) % 37).all()
+    buffer = GrowingArray(np.int32, 2)
+    buffer.extend(np.arange(3))
+    buffer.extend(np.arange(2))
+    assert (buffer.finish() == (0, 1, 2, 0, 1)).all()
+
+
+def test_top_counter():
+    counter = TopCounter(3, width_bits=8)
+    counter.add(np.array((5, 1, 5, 2, 5, 1)))
+    counter.add(np.array((7, 3, 8)), np.array((1, 10, 1)))
+    keys, counts = counter.top()
+    assert (keys == (3, 5, 1)).all()
+    assert (counts >= (10, 3, 2)).all()
+    assert counter.total == 18
+
+
+def test_remove_low_core():
+    data = ((0, 10), (0, 11), (0, 10), (1, 10), (1, 11), (2, 11), (2, 12), (2, 11), (3, 13))
+    dataset = InteractionDataset(data)
+    dataset.normalize_ids()
+    first = InteractionDataset(data)
+    first.normalize_ids()
+    matrix = first.create_adjacency_submatrix()
+    c = first.remove_low_items(matrix, 1) + first.remove_low_users(matrix, 1)
+    assert dataset.remove_low_core(1, 1, max_iterations=1) == [c]
+    assert (dataset[:] == first[:]).all()
+    assert dataset.remove_low_core(1, 1) == [2]
+    assert len(dataset) == 5
+    assert (dataset[:, 0] < 2).all()
+    assert dataset.remove_low_core(1, 1) == []
+
+
+def test_id_finder():
+    finder = IdFinder(np.array((2, 5, 9)))
+    assert finder.find(5) == 1
+    assert finder.find("9") == 2
+    assert finder.find(4) is None
+    ids = finder.find_many(np.array(("9", "1", "2", "10")))
+    assert (ids.filled(-1) == (2, -1, 0, -1)).all()
+    assert finder.reverse(1) == 5
+    values = finder.reverse_many(np.array((2, 3, -1, 0)))
+    assert (values.filled(-1) == (9, -1, -1, 2)).all()
+
+    finder = IdFinder(np.sort(hash_ids(np.array(("a", "b"), dtype=object))), hash=True)
+    ids = finder.find_many(np.array(("b", "c", "a"), dtype=object))
+    assert (np.ma.getmaskarray(ids) == (False, True, False)).all()
+    assert finder.find("a") == ids[2]
+
+
+def test_id_generator():
+    generator = IdGenerator()
+    assert generator.add(7) == 0
+    assert generator.add(3) == 1
+    assert generator.add(7) == 0
+    assert (generator.add_many(np.array((3, 5, 5, 8))) == (1, 2, 2, 3)).all()
+    assert len(generator) == 4
+    assert generator.find(5) == 2
+    assert generator.find(6) is None
+    finder = generator.freeze()
+    assert (finder.data == (3, 5, 7, 8)).all()
+    assert finder.find(7) == 2
+
+
+@pytest.mark.parametrize("chunk_size", (0, 3))
+def test_batch_shuffle_sampler(chunk_size):
+    data = np.random.randint(0, 20, (10, 2))
+    dataset = InteractionDataset(data)
+    dataset.normalize_ids()
+    sampler = BatchShuffleSampler(dataset, 4, chunk_size=chunk_size)
+    batches = list(sampler)
+    assert len(sampler) == 3
+    assert [len(b) for b in batches] == [4, 4, 2]
+    assert sorted(np.concatenate(batches)) == list(range(10))
+    rows = dataset[batches[0]]
+    assert rows.shape == (4, 3)
+    assert (rows[1] == dataset[batches[0][1]]).all()
+    sampler = BatchShuffleSampler(dataset, 4, shuffle=False)
+    assert (next(iter(sampler)) == (0, 1, 2, 3)).all()
+
+
+@pytest.mark.parametrize("pairwise", (False, True))
+def test_negative_sampling_dataset(pairwise):
+    data = ((0, 10), (0, 11), (1, 10), (2, 12), (2, 13))
+    dataset = InteractionDataset(data)
+    dataset.normalize_ids()
+    matrix = dataset.create_adjacency_submatrix()
+    sampler = NegativeSampler(matrix)
+    dyndataset = NegativeSamplingDataset(dataset, sampler, 2, pairwise)
+    assert len(dyndataset) == 5
+    assert dyndataset.samples_per_row == (2 if pairwise else 3)
+    batch = dyndataset[np.array((0, 3))]
+    if pairwise:
+        pos, neg = batch
+        assert (pos == np.repeat(dataset[np.array((0, 3))], 2, axis=0)).all()
+        assert (neg[:, 0] == pos[:, 0]).all()
+        assert (neg[:, -1] == 0).all()
+        negatives = neg
+    else:
+        assert batch.shape == (6, 3)
+        assert (batch[:2] == dataset[np.array((0, 3))]).all()
+        assert (batch[2:, -1] == 0).all()
+        negatives = batch[2:]
+    assert not sampler.contains(negatives[:, 0], negatives[:, 1]).any()
+    assert ((negatives[:, 1] >= 3) & (negatives[:, 1] < 7)).all()
+
+
+def test_tensor_batch_loader():
+    data = np.random.randint(0, 20, (10, 2))
+    dataset = InteractionDataset(data)
+    dataset.normalize_ids()
+    loader = TensorBatchLoader.from_dataset(dataset, 4)
+    batches = list(loader)
+    assert len(loader) == 3
+    assert [len(b) for b in batches] == [4, 4, 2]
+    rows = torch.cat(batches).tolist()
+    assert sorted(rows) == sorted(dataset[:].tolist())
+
+    pairs = InteractionPairDataset(dataset, [np.array((0, 3, 4)), np.array((2, 5))])
+    loader = TensorBatchLoader.from_dataset(pairs, 2, shuffle=False)
+    pos, neg = next(iter(loader))
+    assert (pos.numpy() == dataset[np.array((0, 0))]).all()
+    assert (neg.numpy() == dataset[np.array((3, 4))]).all()
+
+
+def test_grouping_dataset():
+    data = ((0, 10), (0, 11), (1, 10), (1, 12), (1, 13))
+    dataset = InteractionDataset(data)
+    dataset.normalize_ids()
+    groups = [np.array((0, 1)), np.array((2, 3, 4))]
+    grouping = GroupingDataset(dataset, groups)
+    assert len(grouping) == 2
+    assert grouping.candidates == 3
+    assert (grouping[1] == dataset[groups[1]]).all()
+    rows = grouping[np.array((0, 1))]
+    assert rows.shape == (2, 3, 3)
+    assert (rows[1] == dataset[groups[1]]).all()
+    assert (rows[0, :2] == dataset[groups[0]]).all()
+    assert (rows[0, 2, :-1] == dataset[0][:-1]).all()
+    assert rows[0, 2, -1] == GroupingDataset.PADDING_LABEL
+
+    grouping = GroupingDataset(dataset, np.array(((0, 1), (2, 3))))
+    assert grouping.padding is None
+    assert (grouping[np.array((1, ))][0] == dataset[np.array((2, 3))]).all()
+
+
+def test_lazy_column_plan():
+    data = ((2, 2, 4), (2, 3, 5), (3, 4, 4), (4, 1, 5), (3, 4, 6), (2, 1, 4))
+    eager = InteractionDataset(data)
+    eager.normalize_ids()
+    lazy = InteractionDataset(data)
+    lazy.normalize_ids()
+    lazy.plan()
+    assert lazy.lazy
+    for dataset in (eager, lazy):
+        dataset.add_previous_item_column()
+        dataset.swap_columns(0, 2)
+        dataset.combine_columns(1, 2)
+        dataset.swap_columns(0, 1)
+        dataset.prepare_for_recommend()
+    assert lazy.lazy
+    assert len(lazy) == len(eager)
+    assert (lazy.idrange == eager.idrange).all()
+    assert (lazy[:] == eager[:]).all()
+    assert not lazy.lazy
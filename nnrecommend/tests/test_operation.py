@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from nnrecommend.dataset import InteractionDataset
+from nnrecommend.hparams import HyperParameters
+from nnrecommend.operation import get_user_items
+
+
+@pytest.mark.parametrize("format", ("csr", "dok", "coo"))
+def test_get_user_items(format):
+    data = ((2, 2), (2, 5), (3, 1), (4, 5))
+    dataset = InteractionDataset(data)
+    dataset.normalize_ids()
+    matrix = dataset.create_adjacency_submatrix(format=format)
+    assert (np.sort(get_user_items(matrix, 0, dataset.idrange)) == (1, 2)).all()
+    assert (get_user_items(matrix, 1, dataset.idrange) == (0, )).all()
+    assert (get_user_items(matrix, 2, dataset.idrange) == (2, )).all()
+
+
+def test_device_trainset_dynamic_negatives():
+    with pytest.raises(ValueError):
+        HyperParameters({"device_trainset": True, "dynamic_negatives": True})
@@ -0,0 +1,36 @@
+import sqlite3
+from nnrecommend.dataset.podcasts import ItunesPodcastsDatasetSource
+from nnrecommend.hparams import HyperParameters
+
+
+REVIEWS = (
+    ("a1", "pA", 5), ("a2", "pA", 5), ("a3", "pA", 5), ("a4", "pA", 5),
+    ("a1", "pB", 5), ("a2", "pB", 5), ("a3", "pB", 5), ("a4", "pB", 1),
+    ("a1", "pC", 5), ("a2", "pC", 5), ("a3", "pC", 5), ("a4", "pC", 1),
+    ("a1", "pD", 5), ("a2", "pD", 5), ("a4", "pD", 1), ("a1", "pE", 5),
+)
+
+
+def create_database(path: str) -> None:
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE reviews (podcast_id TEXT, rating INTEGER, author_id TEXT, created_at TEXT)")
+        conn.execute("CREATE TABLE podcasts (podcast_id TEXT, itunes_url TEXT, title TEXT)")
+        conn.executemany("INSERT INTO reviews VALUES (?, ?, ?, ?)",
+            [(p, r, a, f"2021-01-{i:02}") for i, (a, p, r) in enumerate(REVIEWS)])
+        conn.executemany("INSERT INTO podcasts VALUES (?, ?, ?)",
+            [(p, f"url{p}", f"title{p}") for p in ("pA", "pB", "pC", "pD", "pE", "pF")])
+
+
+def test_podcasts(tmp_path):
+    path = str(tmp_path / "database.sqlite")
+    create_database(path)
+    src = ItunesPodcastsDatasetSource(path)
+    src.load(HyperParameters({"interaction_context": None}))
+    assert (src.trainset.idrange == (2, 6)).all()
+    assert len(src.trainset) == 6
+    assert len(src.testset) == 2
+    assert (src.testset[:, 1] == (5, 5)).all()
+    assert list(src.items.sort_index()["original_podcast_id"]) == ["pA", "pB", "pC", "pD"]
+    with sqlite3.connect(path) as conn:
+        indexes = conn.execute("SELECT name FROM sqlite_master WHERE type == 'index'").fetchall()
+    assert len(indexes) == 3
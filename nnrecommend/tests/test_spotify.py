@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from nnrecommend.dataset import hash_ids
+from nnrecommend.dataset.spotify import SpotifyDatasetSource, SpotifyMiniDatasetSource, parse_spotify_log, preselect_spotify_logs
+from nnrecommend.hparams import HyperParameters
+
+
+CSV_DATA = """user_id,song_id,skipped,previous_song,other
+u1,s1,0,s0,x
+u1,s2,1,s1,x
+u1,s3,0,s2,x
+u1,s4,0,s3,x
+u2,s2,1,s0,x
+u2,s3,0,s2,x
+u2,s1,0,s3,x
+u2,s4,1,s1,x
+u3,s1,0,s0,x
+u3,s4,0,s1,x
+u3,s2,0,s4,x
+u3,s3,1,s2,x
+"""
+
+
+def test_spotify_chunks(tmp_path):
+    path = tmp_path / "spotify.csv"
+    path.write_text(CSV_DATA)
+    hparams = HyperParameters({"interaction_context": "skip,previous"})
+    src = SpotifyDatasetSource(str(path))
+    src.load(hparams)
+    chunked = SpotifyDatasetSource(str(path))
+    chunked.CHUNK_SIZE = 5
+    chunked.load(hparams)
+    assert (chunked.trainset.idrange == (3, 7, 9, 14)).all()
+    assert (chunked.trainset[:] == src.trainset[:]).all()
+    assert (chunked.testset[:] == src.testset[:]).all()
+    assert len(chunked.trainset) + len(chunked.testset) == 12
+
+
+MINI_CSV_DATA = """session_id,session_position,track_id_clean,skip_1,skip_2,skip_3,not_skipped
+a,2,t2,False,False,True,False
+a,1,t1,True,False,False,False
+a,3,t3,False,False,False,True
+a,4,t4,False,True,False,False
+b,1,t2,False,False,False,True
+b,2,t3,False,True,False,False
+b,3,t1,False,False,False,False
+b,4,t4,True,False,False,False
+c,1,t1,False,False,False,True
+c,2,t4,False,False,True,False
+c,3,t2,True,False,False,False
+c,4,t3,False,False,False,True
+"""
+
+MINI_ITEMS_DATA = """track_id,duration
+t1,100
+t2,200
+t3,300
+t5,500
+"""
+
+
+def test_spotify_mini(tmp_path):
+    (tmp_path / SpotifyMiniDatasetSource.FILENAME).write_text(MINI_CSV_DATA)
+    (tmp_path / SpotifyMiniDatasetSource.ITEMS_FILENAME).write_text(MINI_ITEMS_DATA)
+    hparams = HyperParameters({"interaction_context": "skip"})
+    src = SpotifyMiniDatasetSource(str(tmp_path))
+    src.load(hparams)
+    assert (src.trainset.idrange == (3, 7, 12)).all()
+    skips = np.concatenate((src.trainset[:, 2], src.testset[:, 2])) - 7
+    assert (np.bincount(skips) == (3, 2, 2, 4, 1)).all()
+    assert len(src.items) == 3
+    assert sorted(src.items["original_track_id"]) == ["t1", "t2", "t3"]
+    src.load(HyperParameters({"interaction_context": "skip,position"}))
+    assert (src.trainset.idrange == (3, 7, 12, 15)).all()
+    positions = np.concatenate((src.trainset[:, 3], src.testset[:, 3])) - 12
+    assert (np.bincount(positions) == (3, 6, 3)).all()
+    hparams = HyperParameters({"interaction_context": "all"})
+    assert hparams.should_have_interaction_context("skip")
+    assert not hparams.should_have_interaction_context("position")
+
+
+def test_hash_ids():
+    assert (hash_ids(["a", "t_1"]) == (-4496393130729816112, -3004900606720176677)).all()
+
+
+def test_spotify_logs(tmp_path):
+    lines = MINI_CSV_DATA.splitlines()
+    (tmp_path / "log_0.csv").write_text("\n".join(lines[:9]))
+    (tmp_path / "log_1.csv").write_text("\n".join(lines[:1] + lines[9:]))
+    hparams = HyperParameters({"interaction_context": "skip,previous"})
+    src = SpotifyDatasetSource(str(tmp_path), max_workers=2)
+    src.load(hparams)
+    assert (src.trainset.idrange == (3, 7, 12, 17)).all()
+    rows = np.concatenate((src.trainset[:], src.testset[:]))
+    assert (np.bincount(rows[:, 2] - 7) == (3, 2, 2, 4, 1)).all()
+    # every session has one interaction without previous track
+    assert np.count_nonzero(rows[:, 3] == 12) == 3
+
+
+def test_spotify_log_missing_track(tmp_path):
+    lines = MINI_CSV_DATA.splitlines()
+    path = tmp_path / "log_0.csv"
+    path.write_text("\n".join(lines[:5] + ["a,5,,False,False,False,True"]))
+    session_uniques, track_uniques, columns = parse_spotify_log(str(path), load_skip=False)
+    tracks = track_uniques[columns[1]]
+    assert list(tracks[:4]) == ["t1", "t2", "t3", "t4"]
+    # the missing track keeps its own id instead of taking the last one
+    assert pd.isna(tracks[4])
+    assert list(track_uniques[columns[2]]) == ["", "t1", "t2", "t3", "t4"]
+
+
+def test_spotify_preselect(tmp_path):
+    lines = MINI_CSV_DATA.splitlines()
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    # session a has one more interaction
+    (logs / "log_0.csv").write_text("\n".join(lines[:9] + ["a,5,t1,False,False,False,True"]))
+    (logs / "log_1.csv").write_text("\n".join(lines[:1] + lines[9:]))
+    output = str(tmp_path / "top")
+    dataset = preselect_spotify_logs(str(logs), output, 2, max_workers=2)
+    assert len(dataset) == 9
+    hparams = HyperParameters({"interaction_context": "skip"})
+    src = SpotifyDatasetSource(output)
+    src.load(hparams)
+    assert (src.trainset.idrange == (2, 6, 11)).all()
+    assert len(src.trainset) + len(src.testset) == 9